@@ -1,2 +1,19 @@
+import argparse
+import sys
+
+
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    # "render ..." renders a camera path without a display, everything else starts the interactive game
+    if sys.argv[1:2] == ["render"]:
+        from batch_render import main
+        main(sys.argv[2:])
+    else:
+        parser = argparse.ArgumentParser(description="Interactive ray casting game. Use \"render\" as first argument "
+                                                     "for headless batch rendering.")
+        parser.add_argument("--target-fps", type=int, default=60, help="Frame rate limit and render scale target")
+        parser.add_argument("--cast-processes", type=int, default=0,
+                            help="Processes casting the rays of every frame, 0 casts in the game process")
+        args = parser.parse_args()
+
+        from display import run_game
+        run_game(1280, 720, target_fps=args.target_fps, cast_processes=args.cast_processes)
@@ -0,0 +1,224 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Run without a display
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep stdout clean for raw streams
+
+import argparse
+import io
+import multiprocessing
+import multiprocessing.util
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pygame
+from parallel_caster import ParallelCaster
+from renderer import FirstPersonRenderer
+from textures import TextureAtlas
+from world_file import load_world
+
+
+# World (or parallel caster of the world) and renderer of a render process, created once per process
+_worker_world = None
+_worker_renderer = None
+_worker_output_format = None
+
+
+def _initialize_worker(world_path: str, width: int, height: int, fov_degrees: float, textured: bool,
+                       output_format: str, cast_processes: int):
+    global _worker_world, _worker_renderer, _worker_output_format
+    _worker_world = load_world(world_path)
+    if cast_processes > 1:
+        # Pool processes exit without running atexit functions, only multiprocessing finalizers
+        _worker_world = ParallelCaster(_worker_world, cast_processes)
+        multiprocessing.util.Finalize(_worker_world, _worker_world.close, exitpriority=10)
+    _worker_renderer = FirstPersonRenderer(width, height, fov_degrees,
+                                           texture_atlas=TextureAtlas.default() if textured else None)
+    _worker_output_format = output_format
+
+
+def _render_chunk(poses):
+    # PNG encoding holds the GIL, so frames are encoded in the render processes and only written by the main process
+    frames = []
+    for pos_x, pos_y, angle_degrees in poses:
+        surface = _worker_renderer.render(_worker_world, pos_x, pos_y, angle_degrees)
+        if _worker_output_format == "png":
+            file = io.BytesIO()
+            pygame.image.save(surface, file, "frame.png")
+            frames.append(file.getvalue())
+        else:
+            frames.append(pygame.image.tobytes(surface, "RGB"))
+    return frames
+
+
+def load_camera_path(path: str):
+    """
+    Read a camera path, one pose "x, y, angle" per line. Positions are in cell units, angles in degrees. Lines starting
+    with # are ignored.
+    :return: Array of shape (n, 3) with the poses
+    """
+    poses = np.loadtxt(path, delimiter=",", comments="#", ndmin=2)
+    if poses.shape[1] != 3:
+        raise ValueError(f"Camera path {path} needs 3 values per pose, got {poses.shape[1]}.")
+    return poses
+
+
+class FrameWriter:
+    """
+    Writes encoded frames on a background thread, so disk I/O overlaps with rendering. Frames are passed through a
+    bounded queue: a producer that is faster than the disk blocks instead of piling up frames in memory.
+    """
+
+    def __init__(self, output: str, output_format: str = "png", queue_size: int = 64):
+        self.output = output
+        self.output_format = output_format
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.error = None  # Exception of the writer thread, raised in the producer on the next put
+
+        # PNG frames are single files in the output directory, raw frames are appended to one file or stdout
+        if output_format == "png":
+            os.makedirs(output, exist_ok=True)
+            self.file = None
+        elif output == "-":
+            self.file = sys.stdout.buffer
+        else:
+            self.file = open(output, "wb")
+
+        self.thread = threading.Thread(target=self._write_frames, name="frame writer", daemon=True)
+        self.thread.start()
+
+    def put(self, frame_index: int, frame: bytes):
+        """
+        Queue a frame for writing, waits while the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+        self.frames.put((frame_index, frame))
+
+    def _write_frames(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # Keep taking frames after an error, so the producer is not blocked
+
+            frame_index, frame = item
+            try:
+                if self.file is None:
+                    with open(os.path.join(self.output, f"frame_{frame_index:06d}.png"), "wb") as file:
+                        file.write(frame)
+                else:
+                    self.file.write(frame)
+            except OSError as error:
+                self.error = error
+
+    def close(self):
+        """
+        Write all queued frames and close the output
+        """
+        self.frames.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.flush()
+            if self.file is not sys.stdout.buffer:
+                self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def render_frames(world_path: str, poses, output: str, width: int = 1280, height: int = 720, fov_degrees: float = 60,
+                  output_format: str = "png", textured: bool = True, process_amount: int = None, chunk_size: int = 8,
+                  queue_size: int = 64, cast_processes: int = 0):
+    """
+    Render a camera path without a display. Chunks of poses are rendered and encoded by a pool of processes, every
+    process opens the memory mapped world file once. Finished chunks are passed on in pose order to a FrameWriter, at
+    most two chunks per process are in flight so memory stays bounded for any path length.
+    :param world_path: world file to render, see world_file
+    :param poses: Array of shape (n, 3) with the camera poses (x, y, angle)
+    :param output: directory for "png" frames, file or "-" (stdout) for a "raw" rgb24 stream
+    :param output_format: "png" for a numbered PNG sequence, "raw" for concatenated rgb24 frames (e.g. for
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -i -)
+    :param textured: draw textured walls, floor and ceiling instead of flat colors
+    :param process_amount: render processes, all CPUs if None
+    :param chunk_size: poses rendered per task
+    :param queue_size: encoded frames waiting for the writer at most
+    :param cast_processes: with more than one, every render process splits the rays of its frames over a
+    ParallelCaster with this many processes. Lowers the time per frame for few high resolution frames.
+    :return: amount of frames written
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+    process_amount = process_amount or os.cpu_count()
+    max_pending_chunks = 2 * process_amount
+
+    # Messages go to stderr, so a raw stream can be written to stdout
+    print(f"[RENDER] Rendering {len(poses)} {width}x{height} frames with {process_amount} processes.", file=sys.stderr)
+    start_time = last_report_time = time.perf_counter()
+    frame_amount = 0
+
+    # Render processes are spawned, the executor starts them lazily after the frame writer thread is running and
+    # forking a process with live threads can copy a held lock into the child
+    with ProcessPoolExecutor(process_amount, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_initialize_worker,
+                             initargs=(world_path, width, height, fov_degrees, textured, output_format,
+                                       cast_processes)) as executor, \
+            FrameWriter(output, output_format, queue_size) as writer:
+        pending = deque()
+
+        def write_oldest_chunk():
+            nonlocal frame_amount, last_report_time
+            for frame in pending.popleft().result():
+                writer.put(frame_amount, frame)
+                frame_amount += 1
+
+            if time.perf_counter() - last_report_time > 5:
+                last_report_time = time.perf_counter()
+                print(f"[RENDER] {frame_amount}/{len(poses)} frames, "
+                      f"{frame_amount / (last_report_time - start_time):.1f} FPS.", file=sys.stderr)
+
+        for chunk_start in range(0, len(poses), chunk_size):
+            if len(pending) >= max_pending_chunks:
+                write_oldest_chunk()
+            pending.append(executor.submit(_render_chunk, poses[chunk_start:chunk_start + chunk_size]))
+        while pending:
+            write_oldest_chunk()
+
+    duration = time.perf_counter() - start_time
+    print(f"[RENDER] Wrote {frame_amount} frames to {output} in {duration:.1f} s "
+          f"({frame_amount / max(duration, 1e-9):.1f} FPS).", file=sys.stderr)
+    return frame_amount
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Headless batch rendering of a camera path through a world file")
+    parser.add_argument("world", help="World file to render")
+    parser.add_argument("camera_path", help="Camera path file with one pose \"x, y, angle\" per line")
+    parser.add_argument("output", help="Directory for PNG frames, file or - (stdout) for a raw stream")
+    parser.add_argument("--format", choices=("png", "raw"), default="png", help="PNG sequence or raw rgb24 stream")
+    parser.add_argument("--size", default="1280x720", help="Frame size WIDTHxHEIGHT")
+    parser.add_argument("--fov", type=float, default=60, help="Field of view in degrees")
+    parser.add_argument("--flat", action="store_true", help="Draw flat colors instead of textures")
+    parser.add_argument("--processes", type=int, help="Render processes, all CPUs by default")
+    parser.add_argument("--chunk-size", type=int, default=8, help="Frames rendered per task")
+    parser.add_argument("--queue-size", type=int, default=64, help="Frames waiting for the writer at most")
+    parser.add_argument("--cast-processes", type=int, default=0,
+                        help="Processes casting the rays of every frame of a render process, 0 casts in the render "
+                             "process")
+    args = parser.parse_args(arguments)
+
+    width, height = (int(length) for length in args.size.lower().split("x"))
+    render_frames(args.world, load_camera_path(args.camera_path), args.output, width, height, args.fov,
+                  output_format=args.format, textured=not args.flat, process_amount=args.processes,
+                  chunk_size=args.chunk_size, queue_size=args.queue_size, cast_processes=args.cast_processes)
+
+
+if __name__ == '__main__':
+    main()
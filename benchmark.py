@@ -0,0 +1,321 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Run without a display
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+import pygame
+from world import GridWorld
+from display import Game
+from occupancy_pyramid import OccupancyPyramid
+from parallel_caster import ParallelCaster
+from simulation import Simulation
+from visibility import PotentiallyVisibleSet, line_of_sight
+from matplotlib_version.grid_world import GridWorld as PlotGridWorld, Ray
+
+
+GRID_SIZES = (16, 64, 256)
+WALL_DENSITIES = (0.05, 0.2)
+FOV_WIDTHS = (60, 90)
+RAY_COUNTS = (320, 1280)
+SCREEN_SIZES = ((640, 360), (1280, 720))
+PROCESS_AMOUNTS = (1, 2, 4, 8, 16)  # Amounts above the CPU count of the machine are skipped
+VISIBILITY_GRID_SIZES = (64, 128)
+QUERY_COUNTS = (5000, 50000)
+
+QUICK_MATRIX = {"grid_sizes": (16, 64), "wall_densities": (0.1,), "fov_widths": (60,), "ray_counts": (320,),
+                "screen_sizes": ((640, 360),), "process_amounts": (1, 2), "visibility_grid_sizes": (64,),
+                "query_counts": (50000,)}
+
+
+def time_call(function, min_duration: float = 0.2, min_repeats: int = 3):
+    """
+    Call a function repeatedly and measure its run time
+    :param function: function without arguments to measure
+    :param min_duration: keep repeating until this many seconds were spent in total
+    :param min_repeats: minimum amount of calls
+    :return: Dictionary with best and mean seconds per call and amount of calls
+    """
+    durations = []
+    while len(durations) < min_repeats or sum(durations) < min_duration:
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    return {"best_seconds": min(durations), "mean_seconds": sum(durations) / len(durations), "repeats": len(durations)}
+
+
+def fill_random_walls(grid, wall_density: float, seed: int = 0):
+    """
+    Fill a grid array with random walls, a closed border and an empty center cell for the player
+    :param grid: 2D numpy grid view of a GridWorld
+    :param wall_density: share of cells that are walls
+    :param seed: random seed so runs are comparable
+    """
+    rng = np.random.default_rng(seed)
+    grid[:] = rng.random(grid.shape) < wall_density
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 1
+    grid[grid.shape[0] // 2, grid.shape[1] // 2] = 0
+
+
+def fill_rooms(grid, room_size: int = 16, door_width: int = 2, seed: int = 0):
+    """
+    Fill a grid array with square rooms that are connected by doors, an occluded map for the visibility benchmarks
+    :param grid: 2D numpy grid view of a GridWorld
+    :param room_size: distance between the walls of the rooms in cells
+    :param door_width: width of the door in the top and left wall of every room
+    :param seed: random seed of the door positions
+    """
+    rng = np.random.default_rng(seed)
+    grid[:] = 0
+    grid[::room_size, :] = grid[:, ::room_size] = 1
+    grid[-1, :] = grid[:, -1] = 1
+    for room_y, room_x in itertools.product(range(0, grid.shape[0], room_size), range(0, grid.shape[1], room_size)):
+        if room_y:
+            door = room_x + rng.integers(2, room_size - door_width - 1)
+            grid[room_y, door:door + door_width] = 0
+        if room_x:
+            door = room_y + rng.integers(2, room_size - door_width - 1)
+            grid[door:door + door_width, room_x] = 0
+
+
+def ray_angles(fov_width: float, ray_count: int):
+    # Column center angles around a view direction of 30 degrees, so no ray is aligned with the grid axes
+    return (np.arange(ray_count) + 0.5) / ray_count * fov_width - fov_width / 2 + 30
+
+
+def benchmark_casting(grid_size: int, wall_density: float, fov_width: float, ray_count: int):
+    """
+    Measure rays per second of every caster for one configuration
+    :return: List of result dictionaries
+    """
+    parameters = {"grid_size": grid_size, "wall_density": wall_density, "fov_width": fov_width,
+                  "ray_count": ray_count}
+    angles = ray_angles(fov_width, ray_count)
+
+    # Worlds in cell units (game) and in world units (matplotlib version)
+    world = GridWorld(grid_size, grid_size)
+    fill_random_walls(world.grid, wall_density)
+    plot_world = PlotGridWorld(grid_size, grid_size)
+    plot_world.grid[:] = world.grid
+    center = grid_size // 2 + 0.5
+    plot_center = center * plot_world.cell_size
+    pyramid = OccupancyPyramid(world)
+
+    def scalar_rays(method_name):
+        def cast():
+            for angle in angles:
+                getattr(Ray(plot_center, plot_center, angle), method_name)(plot_world)
+        return cast
+
+    casters = {
+        "Ray.calculate_grid_collision": scalar_rays("calculate_grid_collision"),
+        "Ray.calculate_dda_collision": scalar_rays("calculate_dda_collision"),
+        "Ray.calculate_first_hit": scalar_rays("calculate_first_hit"),
+        "matplotlib_version.GridWorld.cast_rays":
+            lambda: plot_world.cast_rays(np.broadcast_to((plot_center, plot_center), (ray_count, 2)), angles),
+        "world.GridWorld.calc_distance": lambda: [world.calc_distance(center, center, angle) for angle in angles],
+        "world.GridWorld.cast_rays": lambda: world.cast_rays(np.broadcast_to((center, center), (ray_count, 2)), angles),
+        "OccupancyPyramid.cast_rays":
+            lambda: pyramid.cast_rays(np.broadcast_to((center, center), (ray_count, 2)), angles),
+    }
+
+    results = []
+    for name, cast in casters.items():
+        timing = time_call(cast)
+        results.append({"benchmark": name, **parameters, **timing,
+                        "rays_per_second": ray_count / timing["best_seconds"]})
+    return results
+
+
+def benchmark_parallel_casting(grid_size: int, wall_density: float, ray_count: int, process_amounts):
+    """
+    Measure rays per second of the ParallelCaster for every amount of processes, with the speedup over casting in
+    this process
+    :return: List of result dictionaries
+    """
+    world = GridWorld(grid_size, grid_size)
+    fill_random_walls(world.grid, wall_density)
+    origins = np.broadcast_to((grid_size // 2 + 0.5, grid_size // 2 + 0.5), (ray_count, 2))
+    angles = ray_angles(60, ray_count)
+    serial_seconds = time_call(lambda: world.cast_rays(origins, angles))["best_seconds"]
+
+    results = []
+    for process_amount in process_amounts:
+        if process_amount > os.cpu_count():
+            continue
+
+        with ParallelCaster(world, process_amount) as caster:
+            caster.cast_rays(origins, angles)  # Start all workers before measuring
+            timing = time_call(lambda: caster.cast_rays(origins, angles))
+        results.append({"benchmark": "ParallelCaster.cast_rays", "grid_size": grid_size, "wall_density": wall_density,
+                        "ray_count": ray_count, "process_amount": process_amount, **timing,
+                        "rays_per_second": ray_count / timing["best_seconds"],
+                        "speedup": serial_seconds / timing["best_seconds"]})
+    return results
+
+
+def benchmark_visibility(grid_size: int, query_count: int, max_distance: float = 32):
+    """
+    Measure point to point visibility queries on a map of rooms: PotentiallyVisibleSet.can_see with all tables checked
+    against tracing every query with line_of_sight
+    :return: List of result dictionaries
+    """
+    world = GridWorld(grid_size, grid_size)
+    fill_rooms(world.grid)
+    pvs = PotentiallyVisibleSet(world, max_distance=max_distance)
+    pvs.build()
+
+    # Queries from empty cells to positions in random directions within the max distance
+    rng = np.random.default_rng(0)
+    empty_y, empty_x = np.nonzero(world.grid == 0)
+    cells = rng.integers(0, empty_x.size, query_count)
+    starts = np.column_stack([empty_x[cells], empty_y[cells]]) + rng.uniform(0, 1, (query_count, 2))
+    angles = rng.uniform(0, 2 * np.pi, query_count)
+    distances = max_distance * np.sqrt(rng.uniform(0, 1, query_count))
+    ends = (starts + np.column_stack([np.cos(angles), np.sin(angles)]) * distances[:, None]).clip(0.5, grid_size - 0.5)
+
+    trace_seconds = time_call(lambda: line_of_sight(world, starts, ends))["best_seconds"]
+    results = []
+    for name, query in (("line_of_sight", lambda: line_of_sight(world, starts, ends)),
+                        ("PotentiallyVisibleSet.can_see", lambda: pvs.can_see(starts, ends))):
+        timing = time_call(query)
+        results.append({"benchmark": name, "grid_size": grid_size, "query_count": query_count, **timing,
+                        "queries_per_second": query_count / timing["best_seconds"],
+                        "speedup": trace_seconds / timing["best_seconds"]})
+    return results
+
+
+def create_game(world, screen_size):
+    """
+    Create a Game on a hidden screen that displays a given world
+    :return: Game instance and the screen surface
+    """
+    screen = pygame.display.set_mode(screen_size)
+    game = Game(*screen_size)
+    game.grid = world
+    game.grid_cell_objects, game.cell_size = game.initialize_grid(grid_size_x=400, grid_start_x=game.grid_start_x,
+                                                                  grid_start_y=game.grid_start_y,
+                                                                  show_grid_lines=True)
+    game.grid_surface = game.render_grid_surface()
+    game.simulation = Simulation(world, world.size_x // 2 + 0.5, world.size_y // 2 + 0.5, 0)
+    return game, screen
+
+
+def benchmark_frames(grid_size: int, wall_density: float, screen_size):
+    """
+    Measure the frame time of Game.display_frame with the grid view and the first person view
+    :return: List of result dictionaries
+    """
+    world = GridWorld(grid_size, grid_size)
+    fill_random_walls(world.grid, wall_density)
+    game, screen = create_game(world, screen_size)
+
+    results = []
+    for show_first_person in (False, True):
+        game.show_first_person = show_first_person
+        timing = time_call(lambda: game.display_frame(screen))
+        results.append({"benchmark": "Game.display_frame" + (" (first person)" if show_first_person else ""),
+                        "grid_size": grid_size, "wall_density": wall_density, "screen_size": list(screen_size),
+                        **timing, "frames_per_second": 1 / timing["best_seconds"]})
+    game.close()
+    return results
+
+
+def run_benchmarks(grid_sizes=GRID_SIZES, wall_densities=WALL_DENSITIES, fov_widths=FOV_WIDTHS,
+                   ray_counts=RAY_COUNTS, screen_sizes=SCREEN_SIZES, process_amounts=PROCESS_AMOUNTS,
+                   visibility_grid_sizes=VISIBILITY_GRID_SIZES, query_counts=QUERY_COUNTS):
+    """
+    Run the complete benchmark matrix
+    :return: Dictionary with run metadata and a list of results
+    """
+    pygame.init()
+    pygame.font.init()
+
+    results = []
+    for grid_size, wall_density, fov_width, ray_count in itertools.product(grid_sizes, wall_densities, fov_widths,
+                                                                           ray_counts):
+        print(f"[BENCH] Casting: grid={grid_size} density={wall_density} fov={fov_width} rays={ray_count}")
+        results += benchmark_casting(grid_size, wall_density, fov_width, ray_count)
+
+    for grid_size, wall_density, ray_count in itertools.product(grid_sizes, wall_densities, ray_counts):
+        print(f"[BENCH] Parallel casting: grid={grid_size} density={wall_density} rays={ray_count}")
+        results += benchmark_parallel_casting(grid_size, wall_density, ray_count, process_amounts)
+
+    for grid_size, wall_density, screen_size in itertools.product(grid_sizes, wall_densities, screen_sizes):
+        print(f"[BENCH] Frames: grid={grid_size} density={wall_density} screen={screen_size}")
+        results += benchmark_frames(grid_size, wall_density, screen_size)
+
+    for grid_size, query_count in itertools.product(visibility_grid_sizes, query_counts):
+        print(f"[BENCH] Visibility: grid={grid_size} queries={query_count}")
+        results += benchmark_visibility(grid_size, query_count)
+
+    pygame.quit()
+    return {"meta": get_metadata(), "results": results}
+
+
+def get_metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "pygame": pygame.version.ver, "machine": platform.machine()}
+
+
+def result_key(result):
+    return tuple((key, str(value)) for key, value in result.items()
+                 if key not in ("best_seconds", "mean_seconds", "repeats", "rays_per_second", "frames_per_second",
+                                "queries_per_second", "speedup"))
+
+
+def compare_results(baseline, current, threshold: float = 0.1):
+    """
+    Print the change of every benchmark against a baseline run
+    :param baseline: benchmark output dictionary of an earlier run
+    :param current: benchmark output dictionary of this run
+    :param threshold: relative slowdown that counts as a regression
+    :return: amount of regressions
+    """
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = 0
+
+    for result in current["results"]:
+        old_result = baseline_results.get(result_key(result))
+        if old_result is None:
+            continue
+
+        change = result["best_seconds"] / old_result["best_seconds"] - 1
+        regressed = change > threshold
+        regressions += regressed
+        parameters = ", ".join(f"{key}={value}" for key, value in result_key(result)[1:])
+        print(f"[BENCH] {'REGRESSION ' if regressed else ''}{result['benchmark']} ({parameters}): {change:+.1%}")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless ray casting and rendering benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write results to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown counted as regression")
+    parser.add_argument("--quick", action="store_true", help="Run a small matrix only")
+    args = parser.parse_args()
+
+    benchmark_output = run_benchmarks(**(QUICK_MATRIX if args.quick else {}))
+
+    with open(args.output, "w") as file:
+        json.dump(benchmark_output, file, indent=2)
+    print(f"[BENCH] Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regression_amount = compare_results(json.load(file), benchmark_output, args.threshold)
+        raise SystemExit(1 if regression_amount else 0)
@@ -0,0 +1,79 @@
+import cProfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _timed_cast(renderer, world, pos_x: float, pos_y: float, angle_degrees: float, cprofile):
+    # Runs on the cast thread. cProfile only records the thread that enabled it, so a profiled cast enables its own
+    # profile here.
+    if cprofile is not None:
+        try:
+            cprofile.enable()
+        except ValueError:
+            # Since Python 3.12 only one profiler can be active per process, it already records all threads
+            cprofile = None
+
+    start = time.perf_counter()
+    try:
+        ray_hits = renderer.cast(world, pos_x, pos_y, angle_degrees)
+        cast_time = time.perf_counter() - start
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+
+    return ray_hits, cast_time, cprofile
+
+
+class CastWorker:
+    """
+    Casts the rays of the next frame on a background thread while the current frame is drawn and presented. NumPy
+    releases the GIL in the batch casting, so both overlap. A cast is always drawn with the renderer that cast it, so
+    the renderer may change between frames (e.g. by adaptive resolution).
+
+    With a FrameProfiler, the time of every cast measured on the cast thread is added to the "casting" stage of the
+    frame that collects it. While the profiler runs cProfile, casts are profiled on the cast thread as well.
+    """
+
+    def __init__(self, profiler=None):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cast")
+        self.profiler = profiler
+        self.pending = None  # (renderer, future) of the submitted cast
+
+    def submit(self, renderer, world, pos_x: float, pos_y: float, angle_degrees: float):
+        """
+        Start casting a frame. A pending cast that was not collected is dropped.
+        """
+        cprofile = None
+        if self.profiler is not None and self.profiler.cprofile is not None:
+            cprofile = cProfile.Profile()
+
+        self.pending = (renderer, self.executor.submit(_timed_cast, renderer, world, pos_x, pos_y, angle_degrees,
+                                                       cprofile))
+
+    def result(self):
+        """
+        Wait for the submitted cast
+        :return: (renderer, ray_hits) of the submitted cast or None if nothing was submitted
+        """
+        if self.pending is None:
+            return None
+
+        renderer, future = self.pending
+        self.pending = None
+        ray_hits, cast_time, cprofile = future.result()
+
+        if self.profiler is not None:
+            self.profiler.add_time("casting", cast_time)
+            if cprofile is not None:
+                self.profiler.add_cprofile(cprofile)
+        return renderer, ray_hits
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pending = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
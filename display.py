@@ -1,8 +1,17 @@
+import numpy as np
 import pygame
 from world import GridWorld
+from cast_worker import CastWorker
+from parallel_caster import ParallelCaster
+from entities import Entity, EntityGrid
+from resolution import AdaptiveResolution
+from simulation import Simulation
+from textures import TextureAtlas
+from profiler import FrameProfiler
 
 
-def run_game(screen_size_x: int, screen_size_y: int):
+def run_game(screen_size_x: int, screen_size_y: int, cprofile_frames: int = 0, target_fps: int = 60,
+             cast_processes: int = 0):
 
     # Initialize Pygame and set up the window
     pygame.init()
@@ -17,30 +26,49 @@ def run_game(screen_size_x: int, screen_size_y: int):
     delta_time_last_frame = 1
 
     # Create Game instance
-    game = Game()
+    game = Game(screen_size_x, screen_size_y, target_fps, cast_processes)
+    profiler = game.profiler
+    if cprofile_frames:
+        profiler.start_cprofile(cprofile_frames)
 
     """ MAIN GAME LOOP """
 
     while not done:
+        profiler.start_frame()
 
-        done = game.process_events()
+        with profiler.timer("events"):
+            done = game.process_events()
+
+        # Run the fixed time steps of the game state that fit into the last frame, separate from drawing
+        with profiler.timer("simulation"):
+            game.simulation.advance(delta_time_last_frame, *game.get_movement_input())
         game.display_frame(screen)
 
-        # Display FPS
-        text_surface = debug_font.render(f"FPS: {round(1 / delta_time_last_frame)}", False, (255, 255, 255))
+        # Display FPS, render scale and profiling overlay
+        text_surface = debug_font.render(f"FPS: {round(1 / delta_time_last_frame)}  "
+                                         f"Scale: {game.resolution.scale:.0%}", False, (255, 255, 255))
         screen.blit(text_surface, (0, 700))
+        profiler.draw_overlay(screen, debug_font)
 
         # Display updated screen
-        pygame.display.flip()
+        with profiler.timer("flip"):
+            pygame.display.flip()
+        profiler.end_frame()
+
+        # Adapt the render scale to the time the frame took, then tick game and save the full frame time
+        if game.show_first_person:
+            game.resolution.update(profiler.frames[-1]["frame"])
+        delta_time_last_frame = clock.tick(target_fps) / 1000
 
-        # Tick game and save time this frame took to render
-        delta_time_last_frame = clock.tick(60) / 1000
+    game.close()
 
 
 class Game:
     grid_cell_colors = {0: (255, 255, 255), 1: (0, 0, 0)}
+    entity_colors = {0: (40, 180, 70), 1: (140, 90, 40)}  # Grid view color of every sprite
+    max_entity_distance = 32  # Entities further away are not drawn in the first person view
 
-    def __init__(self):
+    def __init__(self, screen_size_x: int, screen_size_y: int, target_fps: int = 60, cast_processes: int = 0):
 
         # Initialize Buttons
         self.button_font = pygame.font.SysFont('Arial', 15)
@@ -48,12 +76,46 @@ class Game:
         self.grid_toggle_button = Button(10, 10, 100, 30, text="Hide Grid", font=self.button_font,
                                          on_click_function=self._on_toggle_grid)
         self.control_buttons.append(self.grid_toggle_button)
+        self.view_toggle_button = Button(120, 10, 100, 30, text="Show 3D View", font=self.button_font,
+                                         on_click_function=self._on_toggle_view)
+        self.control_buttons.append(self.view_toggle_button)
 
         # Initialize world grid
         self.show_world_grid = True  # Toggles display of grid on screen
         self.grid = GridWorld(10, 10)
-        self.grid_cell_objects, self.cell_size = self.initialize_grid(grid_size_x=400, grid_start_x=10,
-                                                                      grid_start_y=50, show_grid_lines=True)
+        self.grid_start_x, self.grid_start_y = 10, 50
+        self.grid_cell_objects, self.cell_size = self.initialize_grid(grid_size_x=400, grid_start_x=self.grid_start_x,
+                                                                      grid_start_y=self.grid_start_y,
+                                                                      show_grid_lines=True)
+
+        # Pre-render grid cells once. Afterwards only changed cells are redrawn on this surface.
+        self.grid_surface = self.render_grid_surface()
+        self.paint_value = None  # Cell value painted while the left mouse button is dragged over the grid
+        self.last_paint_cell = None  # (row, column) of the last painted cell of the current drag
+
+        # Initialize player, moved by W/S (forward, backward), A/D (turn) and Q/E (strafe) in fixed time steps
+        self.simulation = Simulation(self.grid, 1.5, 1.5, 0)
+
+        # Initialize entities, stored by cell
+        self.entities = EntityGrid()
+        self.spawn_entities(20)
+
+        # Initialize first person view
+        self.show_first_person = False  # Toggles the first person view behind the grid
+
+        # First person view rendered at a scale that keeps the frame time within the frame budget. F6 toggles the
+        # adaptive scaling.
+        self.resolution = AdaptiveResolution(screen_size_x, screen_size_y, target_fps,
+                                             texture_atlas=TextureAtlas.default())
+        # Stage timings of every frame. F3 toggles the overlay, F4 dumps the timings, F5 profiles 300 frames.
+        self.profiler = FrameProfiler()
+
+        # Casts the next frame while the current frame is drawn, reports the cast times to the profiler
+        self.cast_worker = CastWorker(self.profiler)
+
+        # With more than one cast process the rays of every frame are split over a process pool. Only pays off for
+        # high resolutions on machines with several cores.
+        self.parallel_caster = ParallelCaster(self.grid, cast_processes) if cast_processes > 1 else None
 
     def process_events(self):
         """
@@ -67,18 +129,52 @@ class Game:
 
             # CASE: Left Mouse button pressed
             elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                click_position = event.pos
-
-                # Check collision with all grid cells
-                if self.show_world_grid:
-                    for cell in self.grid_cell_objects:
-                        if cell["rect"].collidepoint(click_position):
-
-                            # Change cell value and update cell color in grid_cell_objects list
-                            self.grid.toggle_value(cell["row_index"], cell["col_index"])
-                            cell["color"] = Game.grid_cell_colors[self.grid.get_value(cell["row_index"],
-                                                                                      cell["col_index"])]
-                            break
+                cell_index = self.get_cell_index(event.pos)
+
+                # Toggle clicked cell. Dragging afterwards paints the new value on all cells the mouse moves over.
+                if self.show_world_grid and cell_index is not None:
+                    row_index, col_index = cell_index
+                    self.grid.toggle_value(col_index, row_index)
+                    self.paint_value = self.grid.get_value(col_index, row_index)
+                    self.last_paint_cell = cell_index
+                    self.update_grid_cell(row_index, col_index)
+
+            # CASE: Mouse dragged with left mouse button pressed
+            elif event.type == pygame.MOUSEMOTION and self.paint_value is not None:
+                cell_index = self.get_cell_index(event.pos)
+
+                # Paint the line from the last painted cell, so fast drags do not skip the cells in between
+                if self.show_world_grid and cell_index is not None and cell_index != self.last_paint_cell:
+                    self.paint_line(self.last_paint_cell, cell_index)
+                    self.last_paint_cell = cell_index
+
+            # CASE: Left Mouse button released
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                self.paint_value = None
+                self.last_paint_cell = None
+
+            # CASE: Profiling keys
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.toggle_overlay()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                self.profiler.dump("frame_profile.json")
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                self.profiler.start_cprofile(300)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F6:
+                self.resolution.toggle()
+
+    def get_movement_input(self):
+        """
+        Movement input from the currently pressed keys
+        :return: (forward, strafe, turn) input for Simulation.advance
+        """
+        pressed_keys = pygame.key.get_pressed()
+        forward = (pressed_keys[pygame.K_w] or pressed_keys[pygame.K_UP]) - (pressed_keys[pygame.K_s] or
+                                                                             pressed_keys[pygame.K_DOWN])
+        strafe = pressed_keys[pygame.K_e] - pressed_keys[pygame.K_q]
+        turn = (pressed_keys[pygame.K_d] or pressed_keys[pygame.K_RIGHT]) - (pressed_keys[pygame.K_a] or
+                                                                             pressed_keys[pygame.K_LEFT])
+        return forward, strafe, turn
 
     def display_frame(self, screen):
         """
@@ -89,20 +185,60 @@ class Game:
         # Reset screen
         screen.fill((0, 0, 0))
 
+        player_x, player_y, player_angle = self.simulation.pose()
+
+        # Draw first person view. The frame is drawn from the cast submitted in the last frame, the cast of the next
+        # frame runs on the cast worker meanwhile. Only the first frame after showing the view waits for its own cast.
+        # "casting" is the time of the collected cast on the cast worker, "cast wait" the time this frame waited for it.
+        if self.show_first_person:
+            caster = self.grid if self.parallel_caster is None else self.parallel_caster
+            with self.profiler.timer("cast wait"):
+                if self.cast_worker.pending is None:
+                    self.cast_worker.submit(self.resolution.renderer, caster, player_x, player_y, player_angle)
+                renderer, ray_hits = self.cast_worker.result()
+                self.cast_worker.submit(self.resolution.renderer, caster, player_x, player_y, player_angle)
+            with self.profiler.timer("world"):
+                renderer.draw_walls(self.grid, ray_hits)
+
+            # Only entities in the view cone of the drawn cast are drawn, depth tested against its walls
+            with self.profiler.timer("sprites"):
+                visible_entities = self.entities.query_view(*ray_hits["ray_origin"], ray_hits["view_angle"],
+                                                            renderer.fov, Game.max_entity_distance)
+                renderer.draw_sprites(ray_hits, visible_entities)
+            with self.profiler.timer("world"):
+                pygame.surfarray.blit_array(renderer.surface, renderer.frame)
+            with self.profiler.timer("upscale"):
+                screen.blit(self.resolution.upscale(renderer.surface), (0, 0))
+
         # Draw buttons
-        for button in self.control_buttons:
-            button.process(screen)
+        with self.profiler.timer("buttons"):
+            for button in self.control_buttons:
+                button.process(screen)
 
-        # Draw cells for grid display
+        # Draw pre-rendered grid display
         if self.show_world_grid:
-            for cell in self.grid_cell_objects:
-                pygame.draw.rect(screen, cell["color"], cell["rect"])
+            with self.profiler.timer("world"):
+                screen.blit(self.grid_surface, (self.grid_start_x, self.grid_start_y))
+
+                for entity in self.entities:
+                    pygame.draw.circle(screen, Game.entity_colors.get(entity.sprite, (0, 0, 255)),
+                                       (entity.x * self.cell_size + self.grid_start_x,
+                                        entity.y * self.cell_size + self.grid_start_y), 3)
+
+                pygame.draw.circle(screen, (255, 0, 0), (player_x * self.cell_size + self.grid_start_x,
+                                                         player_y * self.cell_size + self.grid_start_y), 5, 2)
 
-            # AAAAAA
-            player_x, player_y = 1.5, 1.5
-            grid_start_x, grid_start_y = 10, 50
-            pygame.draw.circle(screen, (255, 0, 0), (player_x * self.cell_size + grid_start_x,
-                                                     player_y * self.cell_size + grid_start_y), 5, 2)
+    def spawn_entities(self, amount: int, seed: int = 0):
+        """
+        Place entities with random sprites at random positions in empty cells
+        :param amount: amount of entities to place
+        :param seed: random seed
+        """
+        rng = np.random.default_rng(seed)
+        empty_cells = np.argwhere(self.grid.get_grid() == 0)
+        for cell_y, cell_x in empty_cells[rng.integers(0, len(empty_cells), amount)]:
+            offset_x, offset_y = rng.uniform(0.2, 0.8, 2)
+            self.entities.add(Entity(cell_x + offset_x, cell_y + offset_y, int(rng.integers(0, 2))))
 
     def initialize_grid(self, grid_size_x, grid_start_x=0, grid_start_y=0, show_grid_lines=False):
         """
@@ -111,16 +247,18 @@ class Game:
         :param grid_start_x: x position on complete screen of grid start
         :param grid_start_y: y position on complete screen of grid start
         :param show_grid_lines: Leaves a one pixel gap between cells to show grid lines
-        :return: List of dictionaries. One dictionary per cell. Includes rect object, color and grid indexes.
+        :return: Array of dictionaries indexed by [row][column]. One dictionary per cell. Includes rect object, color
+        and grid indexes.
         """
 
         # Get inital values
         grid_state = self.grid.get_grid()
         cell_size = round(grid_size_x / len(grid_state[0]))
-        grid_cell_objects = []  # Return list with cells information & objects
+        grid_cell_objects = []  # Return array with cells information & objects
 
         # Iterate throug every cell state
         for row_index, row in enumerate(grid_state):
+            grid_cell_objects.append([])
             for col_index, value in enumerate(row):
 
                 # Determine parameters for cell to be drawn
@@ -129,14 +267,107 @@ class Game:
                 cell_draw_size = cell_size - (1 if show_grid_lines else 0)
 
                 # Add cell rect object and info to return array
-                grid_cell_objects.append({"rect": pygame.Rect(rect_pos_x, rect_pos_y, cell_draw_size, cell_draw_size),
-                                          "color": Game.grid_cell_colors[value],
-                                          "row_index": row_index,
-                                          "col_index": col_index})
+                cell_rect = pygame.Rect(rect_pos_x, rect_pos_y, cell_draw_size, cell_draw_size)
+                grid_cell_objects[row_index].append({"rect": cell_rect,
+                                                     "color": Game.grid_cell_colors[value],
+                                                     "row_index": row_index,
+                                                     "col_index": col_index})
 
         # Return cell obj array
         return grid_cell_objects, cell_size
 
+    def render_grid_surface(self):
+        """
+        Draw all grid cells onto an off-screen surface that can be blitted to the screen in one call.
+        :return: pygame surface with the complete grid
+        """
+        grid_state = self.grid.get_grid()
+        grid_surface = pygame.Surface((len(grid_state[0]) * self.cell_size, len(grid_state) * self.cell_size))
+
+        for row in self.grid_cell_objects:
+            for cell in row:
+                pygame.draw.rect(grid_surface, cell["color"], cell["rect"].move(-self.grid_start_x, -self.grid_start_y))
+
+        return grid_surface
+
+    def get_cell_index(self, position):
+        """
+        Calculate which grid cell is at a screen position
+        :param position: (x, y) screen position
+        :return: (row index, column index) of the cell or None if the position is outside the grid
+        """
+        col_index = (position[0] - self.grid_start_x) // self.cell_size
+        row_index = (position[1] - self.grid_start_y) // self.cell_size
+
+        if 0 <= row_index < len(self.grid_cell_objects) and 0 <= col_index < len(self.grid_cell_objects[0]):
+            return row_index, col_index
+        return None
+
+    def paint_line(self, start_cell, end_cell):
+        """
+        Set all cells on the line between two cells to the paint value in one write
+        :param start_cell: (row index, column index) of the first cell
+        :param end_cell: (row index, column index) of the last cell
+        """
+        line_cells = Game.get_line_cells(start_cell, end_cell)
+        changed_cells = [(row_index, col_index) for row_index, col_index in line_cells
+                         if self.grid.get_value(col_index, row_index) != self.paint_value]
+        if not changed_cells:
+            return
+
+        self.grid.set_value_list([(col_index, row_index, self.paint_value) for row_index, col_index in changed_cells])
+        for row_index, col_index in changed_cells:
+            self.update_grid_cell(row_index, col_index)
+
+    @staticmethod
+    def get_line_cells(start_cell, end_cell):
+        """
+        Cells on the line between two cells (Bresenham). Neighbouring cells of the line share an edge or a corner.
+        :param start_cell: (row index, column index) of the first cell
+        :param end_cell: (row index, column index) of the last cell
+        :return: list of (row index, column index), including both end cells
+        """
+        row_index, col_index = start_cell
+        end_row, end_col = end_cell
+        delta_row, delta_col = abs(end_row - row_index), -abs(end_col - col_index)
+        step_row = 1 if end_row > row_index else -1
+        step_col = 1 if end_col > col_index else -1
+        error = delta_row + delta_col
+
+        cells = [(row_index, col_index)]
+        while (row_index, col_index) != (end_row, end_col):
+            double_error = 2 * error
+            if double_error >= delta_col:
+                error += delta_col
+                row_index += step_row
+            if double_error <= delta_row:
+                error += delta_row
+                col_index += step_col
+            cells.append((row_index, col_index))
+        return cells
+
+    def update_grid_cell(self, row_index, col_index):
+        """
+        Update the color of a cell from its value in the grid world and redraw it
+        :param row_index: row of the cell
+        :param col_index: column of the cell
+        """
+        cell = self.grid_cell_objects[row_index][col_index]
+        cell["color"] = Game.grid_cell_colors[self.grid.get_value(col_index, row_index)]
+        self.draw_grid_cell(cell)
+
+    def draw_grid_cell(self, cell):
+        """
+        Redraw a single cell on the pre-rendered grid surface after its value changed
+        :param cell: Cell dictionary of grid_cell_objects
+        """
+        pygame.draw.rect(self.grid_surface, cell["color"], cell["rect"].move(-self.grid_start_x, -self.grid_start_y))
+
+    def close(self):
+        self.cast_worker.close()
+        if self.parallel_caster is not None:
+            self.parallel_caster.close()
+
     def _on_toggle_grid(self):
         """
         Toggle the grid display and update the toggle button text
@@ -150,6 +381,19 @@ class Game:
             self.grid_toggle_button.set_text("Hide Grid")
             print("[GAME] Grid shown.")
 
+    def _on_toggle_view(self):
+        """
+        Toggle the first person view and update the toggle button text
+        """
+        if self.show_first_person:
+            self.show_first_person = False
+            self.cast_worker.result()  # Drop the cast of the next frame, it would be outdated when the view is shown
+            self.view_toggle_button.set_text("Show 3D View")
+            print("[GAME] First person view hidden.")
+        else:
+            self.show_first_person = True
+            self.view_toggle_button.set_text("Hide 3D View")
+            print("[GAME] First person view shown.")
 
 
 
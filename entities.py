@@ -0,0 +1,123 @@
+import math
+import numpy as np
+from trig_tables import get_angle_table
+
+
+class Entity:
+    """
+    Object in the world that is drawn as a sprite. Positions are in cell units.
+    """
+
+    __slots__ = ("x", "y", "sprite", "cell")
+
+    def __init__(self, x: float, y: float, sprite: int = 0):
+        self.x = x
+        self.y = y
+        self.sprite = sprite  # Sprite index in the texture atlas
+        self.cell = None  # Spatial hash key while the entity is stored in an EntityGrid
+
+
+class EntityGrid:
+    """
+    Entities stored in a spatial hash keyed by grid cell. Moving an entity only touches the hash when it enters
+    another cell, and view queries only look up the cells around the view cone instead of every entity.
+    """
+
+    sprite_radius = 0.5  # Sprites are one cell wide
+
+    def __init__(self):
+        self.cells = {}  # (cell_x, cell_y) -> list of entities
+        self.entity_amount = 0
+
+    def __len__(self):
+        return self.entity_amount
+
+    def __iter__(self):
+        for entities in self.cells.values():
+            yield from entities
+
+    def add(self, entity: Entity):
+        entity.cell = (math.floor(entity.x), math.floor(entity.y))
+        self.cells.setdefault(entity.cell, []).append(entity)
+        self.entity_amount += 1
+
+    def remove(self, entity: Entity):
+        entities = self.cells[entity.cell]
+        entities.remove(entity)
+        if not entities:
+            del self.cells[entity.cell]
+        entity.cell = None
+        self.entity_amount -= 1
+
+    def move(self, entity: Entity, x: float, y: float):
+        """
+        Move an entity to a new position, updating the spatial hash only if it changes cell
+        """
+        entity.x, entity.y = x, y
+        if (math.floor(x), math.floor(y)) != entity.cell:
+            self.remove(entity)
+            self.add(entity)
+
+    def query_box(self, start_x: float, start_y: float, end_x: float, end_y: float):
+        """
+        All entities in the cells overlapping a box
+        :return: list of entities
+        """
+        start_x, start_y, end_x, end_y = math.floor(start_x), math.floor(start_y), math.floor(end_x), math.floor(end_y)
+        found = []
+
+        # Large boxes walk the occupied cells instead of looking up every cell of the box
+        if (end_x - start_x + 1) * (end_y - start_y + 1) > len(self.cells):
+            for (cell_x, cell_y), entities in self.cells.items():
+                if start_x <= cell_x <= end_x and start_y <= cell_y <= end_y:
+                    found.extend(entities)
+            return found
+
+        for cell_y in range(start_y, end_y + 1):
+            for cell_x in range(start_x, end_x + 1):
+                entities = self.cells.get((cell_x, cell_y))
+                if entities:
+                    found.extend(entities)
+        return found
+
+    def query_view(self, pos_x: float, pos_y: float, angle_degrees: float, fov_degrees: float, max_distance: float,
+                   near_distance: float = 0.05):
+        """
+        Entities that can be visible from a pose. Candidates are collected from the cells of the bounding box of the
+        view cone, then culled at once by distance and field of view. Walls are not checked, the renderer depth tests
+        every sprite column.
+        :param max_distance: largest distance of a visible entity
+        :param near_distance: entities closer than this in view direction are not drawn
+        :return: list of visible entities, sorted back to front
+        """
+        half_fov = fov_degrees / 2
+        radius = EntityGrid.sprite_radius
+
+        # Bounding box of the view cone: position, both cone edges and every axis direction inside the cone
+        corner_angles = [angle_degrees - half_fov, angle_degrees + half_fov]
+        corner_angles += [axis_angle for axis_angle in (0, 90, 180, 270)
+                          if (axis_angle - angle_degrees + half_fov) % 360 < fov_degrees]
+        corners_x, corners_y = [pos_x], [pos_y]
+        for corner_angle in corner_angles:
+            direction_x, direction_y = get_angle_table().direction(corner_angle)
+            corners_x.append(pos_x + direction_x * max_distance)
+            corners_y.append(pos_y + direction_y * max_distance)
+
+        candidates = self.query_box(min(corners_x) - radius, min(corners_y) - radius,
+                                    max(corners_x) + radius, max(corners_y) + radius)
+        if not candidates:
+            return []
+
+        # Depth along the view direction and lateral offset to the right of it
+        view_x, view_y = get_angle_table().direction(angle_degrees)
+        relative_x = np.array([entity.x for entity in candidates]) - pos_x
+        relative_y = np.array([entity.y for entity in candidates]) - pos_y
+        depths = relative_x * view_x + relative_y * view_y
+        laterals = relative_y * view_x - relative_x * view_y
+
+        # Keep entities in front, within the distance and with a part of the sprite inside the field of view
+        visible = ((depths > near_distance) & (np.hypot(relative_x, relative_y) <= max_distance) &
+                   (np.abs(laterals) - radius <= depths * math.tan(math.radians(half_fov))))
+        visible_indexes = np.flatnonzero(visible)
+        back_to_front = visible_indexes[np.argsort(-depths[visible_indexes], kind="stable")]
+        return [candidates[index] for index in back_to_front]
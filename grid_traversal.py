@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def cast_grid_rays(grid, origins, direction_x, direction_y, cell_size: float = 1, max_distances=None):
+    """
+    Cast a batch of rays through a grid at once (Amanatides & Woo DDA). Every step crosses whichever cell border,
+    vertical or horizontal, the ray reaches first. All rays are advanced together using numpy masks, so the cost per
+    step is one array operation for the whole batch instead of one python loop per ray.
+    :param grid: 2D array (rows, columns) of cell values, non zero cells are hit
+    :param origins: Array of shape (n, 2) with the start positions (x, y) of every ray
+    :param direction_x: Array of shape (n,) with the x direction of every ray
+    :param direction_y: Array of shape (n,) with the y direction of every ray
+    :param cell_size: side length of a cell in the units of the positions
+    :param max_distances: Optional array of shape (n,) with the length of every ray. Rays without a hit up to their
+    length stop early and count as leaving the world.
+    :return: Ray cast result dictionary, see hit_results
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    pos_x, pos_y = origins[:, 0], origins[:, 1]
+    size_y, size_x = grid.shape
+    ray_amount = origins.shape[0]
+
+    # Cell each ray starts in and step direction on both axes
+    cell_x = np.floor(pos_x / cell_size).astype(np.int64)
+    cell_y = np.floor(pos_y / cell_size).astype(np.int64)
+    step_x = np.where(direction_x > 0, 1, -1)
+    step_y = np.where(direction_y > 0, 1, -1)
+
+    # Ray length to the next vertical/horizontal border. Border distances are computed from the border position on
+    # every step instead of summed up, so rays through exact cell corners break the tie the same way as the
+    # occupancy pyramid does, which jumps over many borders at once.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_max_x = np.where(direction_x != 0, ((cell_x + (step_x > 0)) * cell_size - pos_x) / direction_x, np.inf)
+        t_max_y = np.where(direction_y != 0, ((cell_y + (step_y > 0)) * cell_size - pos_y) / direction_y, np.inf)
+
+    distance = np.full(ray_amount, np.inf)
+    collided_cell_x = np.full(ray_amount, -1, dtype=np.int64)
+    collided_cell_y = np.full(ray_amount, -1, dtype=np.int64)
+    side = np.full(ray_amount, -1, dtype=np.int8)
+
+    if max_distances is not None:
+        max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.float64), (ray_amount,))
+
+    # Indexes of rays that are still travelling through the world
+    active = np.arange(ray_amount)
+
+    while active.size:
+
+        # Advance every active ray over its closer border
+        step_on_x = t_max_x[active] < t_max_y[active]
+        on_x, on_y = active[step_on_x], active[~step_on_x]
+
+        distance[on_x] = t_max_x[on_x]
+        cell_x[on_x] += step_x[on_x]
+        t_max_x[on_x] = ((cell_x[on_x] + (step_x[on_x] > 0)) * cell_size - pos_x[on_x]) / direction_x[on_x]
+
+        distance[on_y] = t_max_y[on_y]
+        cell_y[on_y] += step_y[on_y]
+        t_max_y[on_y] = ((cell_y[on_y] + (step_y[on_y] > 0)) * cell_size - pos_y[on_y]) / direction_y[on_y]
+
+        side[active] = np.where(step_on_x, 0, 1)
+
+        # Drop rays that left the world or passed their length
+        inside = ((cell_x[active] >= 0) & (cell_x[active] < size_x) &
+                  (cell_y[active] >= 0) & (cell_y[active] < size_y))
+        if max_distances is not None:
+            inside &= distance[active] <= max_distances[active]
+        left_world = active[~inside]
+        distance[left_world] = np.inf
+        side[left_world] = -1
+        active = active[inside]
+
+        # Stop rays that hit a cell
+        collided = grid[cell_y[active], cell_x[active]] != 0
+        hits = active[collided]
+        collided_cell_x[hits] = cell_x[hits]
+        collided_cell_y[hits] = cell_y[hits]
+        active = active[~collided]
+
+    return hit_results(origins, direction_x, direction_y, distance, side, collided_cell_x, collided_cell_y, cell_size)
+
+
+def hit_results(origins, direction_x, direction_y, distance, side, collided_cell_x, collided_cell_y,
+                cell_size: float = 1):
+    """
+    Ray cast result dictionary of a batch of rays from their hit distances and cells
+    :param distance: Array of shape (n,) with the hit distance of every ray, inf for rays without a hit
+    :param side: Array of shape (n,) with the side of the cell that was hit, -1 for rays without a hit
+    :return: Dictionary of arrays with one entry per ray. Rays that leave the world without a hit have collision
+    coordinates and wall offsets of nan, collided cells of -1, a distance of inf and a side of -1. Side 0 means a
+    vertical cell border was hit, side 1 a horizontal one. The wall offset is the position of the collision along the
+    hit wall face from 0 to 1.
+    """
+    pos_x, pos_y = origins[:, 0], origins[:, 1]
+
+    # Collision coordinates on the hit cell border
+    collided = np.isfinite(distance)
+    collision_distance = np.where(collided, distance, 0)
+    collision_coord_x = np.where(collided, pos_x + collision_distance * direction_x, np.nan)
+    collision_coord_y = np.where(collided, pos_y + collision_distance * direction_y, np.nan)
+
+    # Position of the collision along the hit wall face, 0 to 1 within the cell
+    wall_offset = np.where(side == 0, collision_coord_y, collision_coord_x) / cell_size % 1
+
+    return {"collision_coord_x": collision_coord_x,
+            "collision_coord_y": collision_coord_y,
+            "collided_cell_x": collided_cell_x,
+            "collided_cell_y": collided_cell_y,
+            "distance": distance,
+            "side": side,
+            "wall_offset": wall_offset}
@@ -1,29 +1,47 @@
+import logging
 import math
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import patches, lines
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
 from typing import Union, Type
+from grid_traversal import cast_grid_rays
+from trig_tables import get_angle_table
+
+
+logger = logging.getLogger(__name__)
 
 
 class Ray:
+    # Fixed attributes instead of a per instance dict keep rays small when tens of thousands are created
+    __slots__ = ("start_x", "start_y", "angle", "cosine_angle", "sine_angle", "horizontal_grid_collisions",
+                 "vertical_grid_collisions", "collision_coord_x", "collision_coord_y", "collided_cell_x",
+                 "collided_cell_y", "collision_distance", "collision_side", "traversed_cells")
+
     def __init__(self, start_x: int, start_y: int, angle_degrees: Union[int, float]):
         # Start Parameters
         self.start_x = start_x
         self.start_y = start_y
         self.angle = angle_degrees % 360  # Limit to 360 degrees
+        self.cosine_angle, self.sine_angle = get_angle_table().direction(self.angle)
 
-        # Calculated Parameters
-        self.horizontal_grid_collisions = []
-        self.vertical_grid_collisions = []
+        # Calculated Parameters. Traversal history lists are only filled by calculate_dda_collision.
+        self.horizontal_grid_collisions = ()
+        self.vertical_grid_collisions = ()
         self.collision_coord_x = None  # Collision coordiante
         self.collision_coord_y = None  # Collision coordiante
         self.collided_cell_x = None  # Cell position in grid
         self.collided_cell_y = None  # Cell position in grid
+        self.collision_distance = None  # Ray length to collision
+        self.collision_side = None  # 0: vertical cell border, 1: horizontal cell border
+        self.traversed_cells = ()  # Cells the ray passed, including start and collided cell
 
     # TODO TEMP
     def calculate_direction(self, distance=1):
-        angle_radians = math.radians(self.angle)
-        new_x = self.start_x + distance * math.cos(angle_radians)
-        new_y = self.start_y + distance * math.sin(angle_radians)
+        new_x = self.start_x + distance * self.cosine_angle
+        new_y = self.start_y + distance * self.sine_angle
         return new_x, new_y
 
     def calculate_grid_collision(self, grid_class_object):
@@ -36,9 +54,11 @@ class Ray:
         self.collided_cell_x = None  # Cell position in grid
         self.collided_cell_y = None  # Cell position in grid
 
-        # Precalculate sine and cosine
-        cosine_angle = math.cos(math.radians(self.angle))
-        sine_angle = math.sin(math.radians(self.angle))
+        cosine_angle, sine_angle = self.cosine_angle, self.sine_angle
+
+        # Rays along the x axis never cross a horizontal border
+        if sine_angle == 0:
+            return
 
         # Determine line type (pointing upwards or downwards)
         if self.angle > 180:
@@ -101,79 +121,139 @@ class Ray:
                 current_y += cell_size
             current_x += full_cell_horizontal_collision_x_length * cosine_angle
 
-    def BROKEN_calculate_grid_collision(self, grid_class_object):
-
-        # Reset calculated parameters
-        self.vertical_grid_collisions = []
-        self.collision_coord_x = None  # Collision coordiante
-        self.collision_coord_y = None  # Collision coordiante
-        self.collided_cell_x = None  # Cell position in grid
-        self.collided_cell_y = None  # Cell position in grid
-
-        # Precalculate sine and cosine
-        cosine_angle = math.cos(math.radians(self.angle))
-        sine_angle = math.sin(math.radians(self.angle))
-
-        # Determine line type (pointing upwards or downwards)
-        if 90 < self.angle < 270:
-            right_direction = True
-        else:
-            right_direction = False
-
-        # Calculate the next horizontal border
+    def _start_dda(self, grid_class_object):
+        """
+        Start values of the DDA traversal
+        :return: start cell, step direction and ray length to the first vertical/horizontal border on both axes
+        """
+        cosine_angle, sine_angle = self.cosine_angle, self.sine_angle
         cell_size = grid_class_object.cell_size
 
-        """Get coordinates of first collision with horizontal grid border"""
-
-        if right_direction:
-            next_vertical_border = math.floor(self.start_x / cell_size) * cell_size
-        else:
-            next_vertical_border = math.ceil(self.start_x / cell_size) * cell_size
-
-        # Use next horizontal border to calculate distance to it (opposite) and derive adjacent after
-        opposite = next_vertical_border - self.start_x  # Gegenkathete
-        adjacent = opposite / sine_angle  # Ankathete
-
-        # With adjacent, calculate the x coordinate of the grid collision (y coordinate is simply the horizontal border)
-        if right_direction:
-            first_vertical_grid_collision = (self.start_y - adjacent * cosine_angle, next_vertical_border)
-        else:
-            first_vertical_grid_collision = (self.start_y + adjacent * cosine_angle, next_vertical_border)
+        # Cell the ray starts in and step direction on both axes
+        cell_x = math.floor(self.start_x / cell_size)
+        cell_y = math.floor(self.start_y / cell_size)
+        step_x = 1 if cosine_angle > 0 else -1
+        step_y = 1 if sine_angle > 0 else -1
+
+        # Ray length to the first vertical/horizontal border. Like in grid_traversal.cast_grid_rays the border distances
+        # are computed from the border position on every step instead of summed up.
+        t_max_x = ((cell_x + (step_x > 0)) * cell_size - self.start_x) / cosine_angle if cosine_angle != 0 else math.inf
+        t_max_y = ((cell_y + (step_y > 0)) * cell_size - self.start_y) / sine_angle if sine_angle != 0 else math.inf
+
+        return cell_x, cell_y, step_x, step_y, t_max_x, t_max_y
+
+    def iterate_dda_crossings(self, grid_class_object):
+        """
+        Lazily step through the grid cell by cell (Amanatides & Woo DDA). Each step crosses whichever cell border,
+        vertical or horizontal, the ray reaches first. Stops after the first cell that is not empty or at the end of
+        the world.
+        :param grid_class_object: GridWorld to cast the ray in
+        :return: Generator of (x, y, cell_x, cell_y, side, distance, collided) tuples, one per crossed border
+        """
+        cell_x, cell_y, step_x, step_y, t_max_x, t_max_y = self._start_dda(grid_class_object)
+        cell_size = grid_class_object.cell_size
 
-        """Get subsequent horizontal grid collisions (From now on always full cell steps)"""
+        while True:
 
-        current_x, current_y = first_vertical_grid_collision
-        full_cell_vertical_collision_x_length = cell_size / sine_angle  # opposite calculation
+            if t_max_x < t_max_y:
+                distance, side = t_max_x, 0
+                cell_x += step_x
+                t_max_x = ((cell_x + (step_x > 0)) * cell_size - self.start_x) / self.cosine_angle
+            else:
+                distance, side = t_max_y, 1
+                cell_y += step_y
+                t_max_y = ((cell_y + (step_y > 0)) * cell_size - self.start_y) / self.sine_angle
+
+            if not (0 <= cell_x < grid_class_object.cell_amount_x and 0 <= cell_y < grid_class_object.cell_amount_y):
+                return
+
+            collided = grid_class_object.get_value(cell_x, cell_y) != 0
+            yield (self.start_x + distance * self.cosine_angle, self.start_y + distance * self.sine_angle,
+                   cell_x, cell_y, side, distance, collided)
+
+            if collided:
+                return
+
+    def calculate_first_hit(self, grid_class_object):
+        """
+        Same traversal as iterate_dda_crossings, but only the first collision is saved and nothing is allocated per
+        step. The traversal history attributes are left empty.
+        :param grid_class_object: GridWorld to cast the ray in
+        """
+        self.horizontal_grid_collisions = ()
+        self.vertical_grid_collisions = ()
+        self.traversed_cells = ()
+        self.collision_coord_x = None
+        self.collision_coord_y = None
+        self.collided_cell_x = None
+        self.collided_cell_y = None
+        self.collision_distance = None
+        self.collision_side = None
+
+        cell_x, cell_y, step_x, step_y, t_max_x, t_max_y = self._start_dda(grid_class_object)
+        cell_size = grid_class_object.cell_size
+        cell_amount_x, cell_amount_y = grid_class_object.cell_amount_x, grid_class_object.cell_amount_y
+        cells = grid_class_object.cells
 
-        # Calculate world boundaries
-        y_boundary = grid_class_object.cell_amount_y * cell_size
-        x_boundary = grid_class_object.cell_amount_x * cell_size
+        while True:
 
-        # Step through horizontal grid lines until a collision with a cell or the end of the world
-        while 0 < current_y < y_boundary and 0 < current_x < x_boundary:
+            if t_max_x < t_max_y:
+                distance, side = t_max_x, 0
+                cell_x += step_x
+                t_max_x = ((cell_x + (step_x > 0)) * cell_size - self.start_x) / self.cosine_angle
+            else:
+                distance, side = t_max_y, 1
+                cell_y += step_y
+                t_max_y = ((cell_y + (step_y > 0)) * cell_size - self.start_y) / self.sine_angle
+
+            if not (0 <= cell_x < cell_amount_x and 0 <= cell_y < cell_amount_y):
+                return
+
+            if cells[cell_y * cell_amount_x + cell_x] != 0:
+                self.collision_coord_x = self.start_x + distance * self.cosine_angle
+                self.collision_coord_y = self.start_y + distance * self.sine_angle
+                self.collided_cell_x = cell_x
+                self.collided_cell_y = cell_y
+                self.collision_distance = distance
+                self.collision_side = side
+                return
+
+    def calculate_dda_collision(self, grid_class_object):
+        """
+        Cast the ray with iterate_dda_crossings and keep the complete traversal history: crossed horizontal and
+        vertical borders and traversed cells. Use calculate_first_hit if only the collision is needed.
+        :param grid_class_object: GridWorld to cast the ray in
+        """
 
-            # Check collision with cell
-            cell_y_coord = math.floor(current_y / cell_size)
-            cell_x_coord = int(current_x / cell_size) - (1 if right_direction else 0)
+        # Reset calculated parameters
+        self.horizontal_grid_collisions = []
+        self.vertical_grid_collisions = []
+        self.collision_coord_x = None  # Collision coordiante
+        self.collision_coord_y = None  # Collision coordiante
+        self.collided_cell_x = None  # Cell position in grid
+        self.collided_cell_y = None  # Cell position in grid
+        self.collision_distance = None
+        self.collision_side = None
+        self.traversed_cells = [(math.floor(self.start_x / grid_class_object.cell_size),
+                                 math.floor(self.start_y / grid_class_object.cell_size))]
 
-            if grid_class_object.get_value(cell_x_coord, cell_y_coord) != 0:
+        for current_x, current_y, cell_x, cell_y, side, distance, collided in self.iterate_dda_crossings(
+                grid_class_object):
+            self.traversed_cells.append((cell_x, cell_y))
 
+            if collided:
                 # Save values for collision with cell
                 self.collision_coord_x = current_x
                 self.collision_coord_y = current_y
-                self.collided_cell_x = cell_x_coord
-                self.collided_cell_y = cell_y_coord
-                break
+                self.collided_cell_x = cell_x
+                self.collided_cell_y = cell_y
+                self.collision_distance = distance
+                self.collision_side = side
 
-            else:
+            elif side == 0:
                 self.vertical_grid_collisions.append((current_x, current_y))
-
-            # Increment coordinates for collision check
-            if right_direction:
-                current_x -= cell_size
             else:
-                current_x += cell_size
-            current_y += full_cell_vertical_collision_x_length * cosine_angle
+                self.horizontal_grid_collisions.append((current_x, current_y))
 
 
 class GridWorld:
@@ -186,10 +266,18 @@ class GridWorld:
         self.cell_amount_y = cell_amount_y
         self.cell_size = cell_size
 
-        # Initialize grid
-        self.grid = [[0 for _ in range(self.cell_amount_x)] for _ in range(self.cell_amount_y)]
+        # Initialize grid. Cells are stored packed as one byte each, row after row (row stride = cell_amount_x). The
+        # grid attribute is a 2D numpy view (rows, columns) on the same memory for vectorized access.
+        self.cells = bytearray(self.cell_amount_x * self.cell_amount_y)
+        self.grid = np.frombuffer(self.cells, dtype=np.uint8).reshape(self.cell_amount_y, self.cell_amount_x)
         self.rays = []
 
+        # Ray hit cache. ray_cache_poses holds the pose (start_x, start_y, angle) every ray with an up to date
+        # collision result was cast with. cell_rays maps every cell to the rays that traversed it, so a changed cell
+        # only invalidates the rays that passed it.
+        self.ray_cache_poses = {}
+        self.cell_rays = {}
+
     def __str__(self):
         return_str = ""
         for row in self.grid:
@@ -198,18 +286,28 @@ class GridWorld:
         return return_str
 
     def get_value(self, pos_x: int, pos_y: int):
-        return self.grid[pos_y][pos_x]
+        # Index the 2D view, an x past the row end of the packed cells must fail instead of reading the next row
+        return self.grid.item(pos_y, pos_x)
 
     def set_value(self, pos_x: int, pos_y: int, value: int):
-        self.grid[pos_y][pos_x] = value
-        print(f"[GRID] Cell x={pos_x}, y={pos_y} set to {value}.")
+        self.grid[pos_y, pos_x] = value
+        logger.debug("Cell x=%s, y=%s set to %s.", pos_x, pos_y, value)
+        self.invalidate_cell(pos_x, pos_y)
+
+    def toggle_value(self, pos_x: int, pos_y: int):
+        if self.get_value(pos_x, pos_y) == 0:
+            self.set_value(pos_x, pos_y, 1)
+        else:
+            self.set_value(pos_x, pos_y, 0)
+
+    def get_grid(self):
+        return self.grid
 
     def set_value_line(self, start_x, start_y, length, orientation, value):
-        for i in range(length):
-            if orientation == "h":
-                self.set_value(start_x + i, start_y, value)
-            elif orientation == "v":
-                self.set_value(start_x, start_y + i, value)
+        if orientation == "h":
+            self.set_value_block(start_x, start_y, length, 1, value)
+        elif orientation == "v":
+            self.set_value_block(start_x, start_y, 1, length, value)
 
     def set_value_border(self, value):
         self.set_value_line(0, 0, self.cell_amount_x, "h", value)
@@ -218,13 +316,100 @@ class GridWorld:
         self.set_value_line(0, 0, self.cell_amount_y, "v", value)
 
     def set_value_block(self, start_x, start_y, length_x, length_y, value):
-        for i in range(length_y):
-            self.set_value_line(start_x, start_y + i, length_x, "h", value)
+        self.grid[start_y:start_y + length_y, start_x:start_x + length_x] = value
+        logger.debug("Block x=%s, y=%s, %sx%s set to %s.", start_x, start_y, length_x, length_y, value)
+        self.invalidate_block(start_x, start_y, length_x, length_y)
+
+    def set_value_array(self, start_x, start_y, values):
+        """
+        Copy a 2D array of cell values (rows, columns) into the grid in one write
+        """
+        values = np.asarray(values, dtype=np.uint8)
+        self.grid[start_y:start_y + values.shape[0], start_x:start_x + values.shape[1]] = values
+        logger.debug("Array x=%s, y=%s, %sx%s set.", start_x, start_y, values.shape[1], values.shape[0])
+        self.invalidate_block(start_x, start_y, values.shape[1], values.shape[0])
+
+    def set_value_list(self, edits):
+        """
+        Set many single cells in one write
+        :param edits: list or array of (pos_x, pos_y, value) edits
+        """
+        edits = np.asarray(edits, dtype=np.int64).reshape(-1, 3)
+        if ((edits[:, 0] < 0) | (edits[:, 0] >= self.cell_amount_x) |
+                (edits[:, 1] < 0) | (edits[:, 1] >= self.cell_amount_y)).any():
+            raise IndexError(f"Cell positions must be within {self.cell_amount_x}x{self.cell_amount_y}.")
+        if ((edits[:, 2] < 0) | (edits[:, 2] > 255)).any():
+            raise ValueError("Cell values must be in range(0, 256).")
+        self.grid[edits[:, 1], edits[:, 0]] = edits[:, 2]
+        logger.debug("%s cells set.", edits.shape[0])
+        for pos_x, pos_y in edits[:, :2].tolist():
+            self.invalidate_cell(pos_x, pos_y)
+
+    def invalidate_cell(self, pos_x, pos_y):
+        """
+        Mark the cached results of all rays that traversed a cell as outdated
+        """
+        for ray in self.cell_rays.pop((pos_x, pos_y), ()):
+            self.ray_cache_poses.pop(ray, None)
+
+    def invalidate_block(self, start_x, start_y, length_x, length_y):
+        """
+        Mark the cached results of all rays that traversed a block of cells as outdated
+        """
+        # Iterate over whichever is smaller, the block or the indexed cells
+        if length_x * length_y <= len(self.cell_rays):
+            for pos_y in range(start_y, start_y + length_y):
+                for pos_x in range(start_x, start_x + length_x):
+                    self.invalidate_cell(pos_x, pos_y)
+        else:
+            for pos_x, pos_y in list(self.cell_rays):
+                if start_x <= pos_x < start_x + length_x and start_y <= pos_y < start_y + length_y:
+                    self.invalidate_cell(pos_x, pos_y)
+
+    def cast_rays(self, origins, angles):
+        """
+        Cast a batch of rays through the grid at once with grid_traversal.cast_grid_rays
+        :param origins: Array of shape (n, 2) with the start coordinates (x, y) of every ray
+        :param angles: Array of shape (n,) with the angle of every ray in degrees
+        :return: Ray cast result dictionary of grid_traversal.cast_grid_rays, positions and distances in world units
+        """
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1) % 360
+        direction_x, direction_y = get_angle_table().directions(angles)
+        return cast_grid_rays(self.grid, origins, direction_x, direction_y, cell_size=self.cell_size)
 
     def add_ray(self, start_x, start_y, angle_degrees):
         new_ray = Ray(start_x, start_y, angle_degrees)
         self.rays.append(new_ray)
 
+    def move_rays(self, start_x, start_y):
+        """
+        Move the start of all rays to a new origin. Drops the complete ray hit cache.
+        """
+        for ray in self.rays:
+            ray.start_x, ray.start_y = start_x, start_y
+        self.ray_cache_poses.clear()
+        self.cell_rays.clear()
+
+    def update_rays(self):
+        """
+        Recast every ray that has no up to date cached collision result
+        """
+        for ray in self.rays:
+            pose = (ray.start_x, ray.start_y, ray.angle)
+            if self.ray_cache_poses.get(ray) == pose:
+                continue
+
+            # Remove the previous traversal of the ray from the index before casting it again
+            for cell in ray.traversed_cells:
+                cell_rays = self.cell_rays.get(cell)
+                if cell_rays is not None:
+                    cell_rays.discard(ray)
+
+            ray.calculate_dda_collision(grid_class_object=self)
+            for cell in ray.traversed_cells:
+                self.cell_rays.setdefault(cell, set()).add(ray)
+            self.ray_cache_poses[ray] = pose
+
     def plot(self, size: int = 5, show_cell_borders: bool = True, show_cell_states: bool = True, show_rays: bool = True):
 
         fig, ax = plt.subplots(figsize=(int(size * (self.cell_amount_x / self.cell_amount_y)), size))
@@ -245,10 +430,8 @@ class GridWorld:
                 plt.axvline(i * self.cell_size, color=GridWorld.cell_borders_color, linestyle="dashed", linewidth="1")
 
         if show_rays:
+            self.update_rays()
             for ray in self.rays:
-                # TEST
-                ray.calculate_grid_collision(grid_class_object=self)
-
                 for x, y in ray.horizontal_grid_collisions:
                     ax.plot(x, y, marker='.', color="red")
 
@@ -270,6 +453,69 @@ class GridWorld:
 
         return fig
 
+    def plot_fast(self, size: int = 5, show_cell_borders: bool = True, show_cell_states: bool = True,
+                  show_rays: bool = True):
+        """
+        Same content as plot with a fixed amount of artists: the cells are one image, cell borders and rays are one
+        line collection each and all crossing and collision markers are one scatter. The figure is not managed by
+        pyplot, so it can be created and saved without a display.
+        :return: matplotlib figure
+        """
+        fig = Figure(figsize=(int(size * (self.cell_amount_x / self.cell_amount_y)), size))
+        ax = fig.add_subplot()
+        world_width, world_height = self.cell_amount_x * self.cell_size, self.cell_amount_y * self.cell_size
+
+        if show_cell_states:
+            # Color lookup table for all cell values, empty cells are transparent
+            value_colors = np.array([to_rgba(GridWorld.cell_value_colors.get(value, "black")) for value in range(256)])
+            value_colors[0] = (0, 0, 0, 0)
+            ax.imshow(value_colors[self.grid], extent=(0, world_width, world_height, 0), interpolation="nearest")
+
+        if show_cell_borders:
+            border_positions_x = np.arange(self.cell_amount_x + 1) * self.cell_size
+            border_positions_y = np.arange(self.cell_amount_y + 1) * self.cell_size
+            borders = ([((x, 0), (x, world_height)) for x in border_positions_x] +
+                       [((0, y), (world_width, y)) for y in border_positions_y])
+            ax.add_collection(LineCollection(borders, colors=GridWorld.cell_borders_color, linestyles="dashed",
+                                             linewidths=1))
+
+        if show_rays:
+            self.update_rays()
+
+            hit_rays = [ray for ray in self.rays if ray.collision_coord_x is not None]
+            ax.add_collection(LineCollection([((ray.start_x, ray.start_y), (ray.collision_coord_x,
+                                                                            ray.collision_coord_y))
+                                              for ray in hit_rays]))
+
+            crossings = [crossing for ray in self.rays
+                         for crossing in (*ray.horizontal_grid_collisions, *ray.vertical_grid_collisions)]
+            collisions = [(ray.collision_coord_x, ray.collision_coord_y) for ray in hit_rays]
+            markers = np.array(crossings + collisions, dtype=np.float64).reshape(-1, 2)
+            marker_colors = ["red"] * len(crossings) + ["lime"] * len(collisions)
+            ax.scatter(markers[:, 0], markers[:, 1], c=marker_colors, s=12, zorder=3)
+
+        ax.set_xlim(0, world_width)
+        ax.set_ylim(world_height, 0)
+        ax.xaxis.tick_top()
+        ax.set_aspect('equal')
+
+        return fig
+
+    def save_plot(self, path: str, fast: bool = True, dpi: int = 100, **plot_options):
+        """
+        Render the grid straight to an image file, e.g. a PNG for batch debug snapshots
+        :param path: output file path
+        :param fast: use plot_fast instead of plot
+        :param dpi: resolution of the image
+        :param plot_options: keyword arguments for the plot method
+        """
+        if fast:
+            self.plot_fast(**plot_options).savefig(path, dpi=dpi)
+        else:
+            fig = self.plot(**plot_options)
+            fig.savefig(path, dpi=dpi)
+            plt.close(fig)
+
 
 if __name__ == '__main__':
     gw = GridWorld(15, 10)
@@ -0,0 +1,268 @@
+import math
+import numpy as np
+from grid_traversal import hit_results
+from trig_tables import get_angle_table
+from world import GridWorld
+
+
+def _cell_at_distance(pos, direction, distance, border_ties_crossed: bool):
+    """
+    Cell along one axis a ray is in after travelling a distance, decided like the DDA of grid_traversal.cast_grid_rays:
+    a border is crossed if its distance, computed from the border position, is below the travelled distance. At
+    exact cell corners the DDA steps over the horizontal border first, so borders at exactly the distance count as
+    crossed for the y axis only.
+    :param pos: ray start position on the axis
+    :param direction: ray direction on the axis
+    :param distance: travelled distance
+    :param border_ties_crossed: whether a border at exactly the distance was crossed
+    :return: cell index (int64)
+    """
+    start_cell = np.floor(pos)
+    cell = np.floor(pos + distance * direction)
+
+    # Floating point rounding of the position can be off by one cell, compare the border distances instead
+    forward = direction > 0
+    step = np.where(forward, 1, -1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        enter_distance = (np.where(forward, cell, cell + 1) - pos) / direction
+        leave_distance = (np.where(forward, cell + 1, cell) - pos) / direction
+    if border_ties_crossed:
+        entered, left = enter_distance <= distance, leave_distance <= distance
+    else:
+        entered, left = enter_distance < distance, leave_distance < distance
+    cell = np.where((cell != start_cell) & ~entered, cell - step, np.where(left, cell + step, cell))
+
+    return np.where(direction != 0, cell, start_cell).astype(np.int64)
+
+
+def _scalar_cell_at_distance(pos: float, direction: float, distance: float, border_ties_crossed: bool):
+    """
+    _cell_at_distance for a single ray without numpy overhead
+    """
+    start_cell = math.floor(pos)
+    if direction == 0:
+        return start_cell
+    cell = math.floor(pos + distance * direction)
+
+    step = 1 if direction > 0 else -1
+    enter_distance = ((cell if step > 0 else cell + 1) - pos) / direction
+    leave_distance = ((cell + 1 if step > 0 else cell) - pos) / direction
+    if border_ties_crossed:
+        entered, left = enter_distance <= distance, leave_distance <= distance
+    else:
+        entered, left = enter_distance < distance, leave_distance < distance
+    if cell != start_cell and not entered:
+        return cell - step
+    return cell + step if left else cell
+
+
+class OccupancyPyramid:
+    """
+    Multi level occupancy map of a GridWorld for empty space skipping. Level 0 is the grid itself, every cell of level
+    k tells whether any wall exists in the matching block of 2^k x 2^k grid cells. Rays jump over the largest empty
+    block around them and only step cell by cell next to walls. Cell changes of the world update the pyramid
+    incrementally. Has the same cast_rays interface as GridWorld.
+    """
+
+    def __init__(self, world: GridWorld):
+        self.world = world
+        self.levels = []
+        self.build()
+
+        self.world.on_change_functions.append(self.update_cell)
+        self.world.on_region_change_functions.append(self.update_region)
+
+    @property
+    def grid(self):
+        return self.world.grid
+
+    @property
+    def floor_grid(self):
+        return self.world.floor_grid
+
+    def build(self):
+        """
+        Build all levels from the current grid. Needed after the grid was changed without the GridWorld set functions.
+        """
+        self.levels = [self.world.grid]
+        occupied = self.world.grid != 0
+
+        while occupied.shape[0] > 1 or occupied.shape[1] > 1:
+            # Pad to an even size and combine blocks of 2 x 2 cells
+            padded = np.zeros((occupied.shape[0] + occupied.shape[0] % 2, occupied.shape[1] + occupied.shape[1] % 2),
+                              dtype=bool)
+            padded[:occupied.shape[0], :occupied.shape[1]] = occupied
+            occupied = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).any(axis=(1, 3))
+            self.levels.append(occupied)
+
+    def update_cell(self, pos_x: int, pos_y: int, value: int):
+        """
+        Update all levels above a changed cell. Stops as soon as a level does not change.
+        """
+        if len(self.levels) == 1:
+            return
+
+        self.levels[0] = self.world.grid
+        for level in range(1, len(self.levels)):
+            pos_x, pos_y = pos_x >> 1, pos_y >> 1
+            block_occupied = self.levels[level - 1][2 * pos_y:2 * pos_y + 2, 2 * pos_x:2 * pos_x + 2].any()
+            if self.levels[level][pos_y, pos_x] == block_occupied:
+                break
+            self.levels[level][pos_y, pos_x] = block_occupied
+
+    def update_region(self, start_x: int, start_y: int, length_x: int, length_y: int):
+        """
+        Update all levels above a changed block of cells
+        """
+        self.levels[0] = self.world.grid
+        x_0, y_0, x_1, y_1 = start_x, start_y, start_x + length_x - 1, start_y + length_y - 1
+
+        for level in range(1, len(self.levels)):
+            x_0, y_0, x_1, y_1 = x_0 >> 1, y_0 >> 1, x_1 >> 1, y_1 >> 1
+
+            # Combine the 2 x 2 child cells of every block in range, padded at the grid edges
+            children = self.levels[level - 1][2 * y_0:2 * y_1 + 2, 2 * x_0:2 * x_1 + 2] != 0
+            padded = np.zeros((2 * (y_1 - y_0 + 1), 2 * (x_1 - x_0 + 1)), dtype=bool)
+            padded[:children.shape[0], :children.shape[1]] = children
+            self.levels[level][y_0:y_1 + 1, x_0:x_1 + 1] = padded.reshape(y_1 - y_0 + 1, 2, x_1 - x_0 + 1, 2).any(
+                axis=(1, 3))
+
+    def calc_distance(self, pos_x, pos_y, angle_degrees):
+        """
+        Distance from a position to the first non empty cell in a direction, skipping empty blocks
+        :return: Dictionary like GridWorld.calc_distance
+        """
+        direction_x, direction_y = get_angle_table().direction(angle_degrees)
+        grid = self.world.grid
+        size_x, size_y = self.world.size_x, self.world.size_y
+
+        cell_x, cell_y = math.floor(pos_x), math.floor(pos_y)
+        distance, side = 0, -1
+        first_step = True  # The start cell is never a hit
+
+        while 0 <= cell_x < size_x and 0 <= cell_y < size_y:
+
+            if not first_step and grid[cell_y, cell_x]:
+                collision_coord_x = pos_x + distance * direction_x
+                collision_coord_y = pos_y + distance * direction_y
+                return {"collision_coord_x": collision_coord_x, "collision_coord_y": collision_coord_y,
+                        "collided_cell_x": cell_x, "collided_cell_y": cell_y,
+                        "distance": distance, "side": side,
+                        "wall_offset": (collision_coord_y if side == 0 else collision_coord_x) % 1}
+            first_step = False
+
+            # Largest empty block around the current cell
+            level = 0
+            while level + 1 < len(self.levels) and not self.levels[level + 1][cell_y >> (level + 1),
+                                                                              cell_x >> (level + 1)]:
+                level += 1
+            block_x, block_y = cell_x >> level << level, cell_y >> level << level
+            block_size = 1 << level
+
+            # Leave the block over the closer border
+            exit_x = block_x + block_size if direction_x > 0 else block_x
+            exit_y = block_y + block_size if direction_y > 0 else block_y
+            t_x = (exit_x - pos_x) / direction_x if direction_x != 0 else math.inf
+            t_y = (exit_y - pos_y) / direction_y if direction_y != 0 else math.inf
+
+            if t_x < t_y:
+                distance, side = t_x, 0
+                cell_x = exit_x if direction_x > 0 else exit_x - 1
+                cell_y = _scalar_cell_at_distance(pos_y, direction_y, distance, True)
+                cell_y = min(max(cell_y, block_y), block_y + block_size - 1)
+            else:
+                distance, side = t_y, 1
+                cell_y = exit_y if direction_y > 0 else exit_y - 1
+                cell_x = _scalar_cell_at_distance(pos_x, direction_x, distance, False)
+                cell_x = min(max(cell_x, block_x), block_x + block_size - 1)
+
+        return {"collision_coord_x": None, "collision_coord_y": None,
+                "collided_cell_x": None, "collided_cell_y": None,
+                "distance": None, "side": None, "wall_offset": None}
+
+    def cast_rays(self, origins, angles, directions=None, max_distances=None):
+        """
+        Cast a batch of rays, skipping empty blocks. All rays are advanced together using numpy masks.
+        :param origins: Array of shape (n, 2) with the start positions (x, y) of every ray
+        :param angles: Array of shape (n,) with the angle of every ray in degrees
+        :param directions: Optional precomputed (x, y) direction arrays of the rays
+        :param max_distances: Optional array of shape (n,) with the length of every ray. Rays without a hit up to
+        their length stop early and count as leaving the world.
+        :return: Ray cast result dictionary of grid_traversal.cast_grid_rays
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1)
+        pos_x, pos_y = origins[:, 0], origins[:, 1]
+        ray_amount = angles.shape[0]
+
+        if directions is None:
+            direction_x, direction_y = get_angle_table().directions(angles)
+        else:
+            direction_x, direction_y = (np.asarray(direction, dtype=np.float64).reshape(-1) for direction in directions)
+
+        grid = self.world.grid
+        cell_x = np.floor(pos_x).astype(np.int64)
+        cell_y = np.floor(pos_y).astype(np.int64)
+        ray_distance = np.zeros(ray_amount)
+        ray_side = np.full(ray_amount, -1, dtype=np.int8)
+
+        distance = np.full(ray_amount, np.inf)
+        collided_cell_x = np.full(ray_amount, -1, dtype=np.int64)
+        collided_cell_y = np.full(ray_amount, -1, dtype=np.int64)
+        side = np.full(ray_amount, -1, dtype=np.int8)
+
+        if max_distances is not None:
+            max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.float64), (ray_amount,))
+
+        active = np.arange(ray_amount)
+        first_step = True  # The start cell is never a hit
+
+        while active.size:
+
+            # Drop rays that left the world or passed their length. Skipped blocks are empty, so a ray that passed its
+            # length in a block jump has no hit within its length.
+            active_x, active_y = cell_x[active], cell_y[active]
+            inside = (active_x >= 0) & (active_x < self.world.size_x) & (active_y >= 0) & (active_y < self.world.size_y)
+            if max_distances is not None:
+                inside &= ray_distance[active] <= max_distances[active]
+            active, active_x, active_y = active[inside], active_x[inside], active_y[inside]
+
+            # Stop rays that hit a cell
+            if not first_step:
+                collided = grid[active_y, active_x] != 0
+                hits = active[collided]
+                distance[hits] = ray_distance[hits]
+                side[hits] = ray_side[hits]
+                collided_cell_x[hits], collided_cell_y[hits] = active_x[collided], active_y[collided]
+                active, active_x, active_y = active[~collided], active_x[~collided], active_y[~collided]
+            first_step = False
+
+            # Largest empty block around the current cell of every ray
+            levels = np.zeros(active.size, dtype=np.int64)
+            climbing = np.ones(active.size, dtype=bool)
+            for level in range(1, len(self.levels)):
+                climbing &= ~self.levels[level][active_y >> level, active_x >> level].astype(bool)
+                if not climbing.any():
+                    break
+                levels[climbing] = level
+            block_x, block_y = active_x >> levels << levels, active_y >> levels << levels
+            block_size = 1 << levels
+
+            # Leave the block over the closer border
+            dx, dy = direction_x[active], direction_y[active]
+            exit_x = np.where(dx > 0, block_x + block_size, block_x)
+            exit_y = np.where(dy > 0, block_y + block_size, block_y)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t_x = np.where(dx != 0, (exit_x - pos_x[active]) / dx, np.inf)
+                t_y = np.where(dy != 0, (exit_y - pos_y[active]) / dy, np.inf)
+            step_on_x = t_x < t_y
+            t = np.where(step_on_x, t_x, t_y)
+
+            crossed_x = np.clip(_cell_at_distance(pos_x[active], dx, t, False), block_x, block_x + block_size - 1)
+            crossed_y = np.clip(_cell_at_distance(pos_y[active], dy, t, True), block_y, block_y + block_size - 1)
+            cell_x[active] = np.where(step_on_x, np.where(dx > 0, exit_x, exit_x - 1), crossed_x)
+            cell_y[active] = np.where(step_on_x, crossed_y, np.where(dy > 0, exit_y, exit_y - 1))
+            ray_distance[active] = t
+            ray_side[active] = np.where(step_on_x, 0, 1)
+
+        return hit_results(origins, direction_x, direction_y, distance, side, collided_cell_x, collided_cell_y)
@@ -0,0 +1,100 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+from world import GridWorld
+
+logger = logging.getLogger(__name__)
+
+
+# Grid world of a worker process. Its cells live in the shared memory block of the ParallelCaster.
+_worker_world = None
+_worker_shared_memory = None
+
+
+def _initialize_worker(shared_memory_name: str, size_x: int, size_y: int):
+    global _worker_world, _worker_shared_memory
+    _worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    _worker_world = GridWorld(size_x, size_y, buffer=_worker_shared_memory.buf)
+
+
+def _cast_band(origins, angles, directions, max_distances):
+    return _worker_world.cast_rays(origins, angles, directions, max_distances)
+
+
+class ParallelCaster:
+    """
+    Casts rays with a pool of processes. The rays are split into bands of neighbouring columns and every band is cast
+    by one worker. The cells of the world are moved into shared memory, so workers always see the current grid and
+    the map is never pickled. Has the same cast_rays interface as GridWorld.
+    """
+
+    def __init__(self, world: GridWorld, process_amount: int = None, bands_per_process: int = 2):
+        self.world = world
+        self.process_amount = process_amount or os.cpu_count()
+        self.band_amount = self.process_amount * bands_per_process
+
+        # Move world cells into shared memory. Edits of the world are visible to all workers from now on.
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=max(world.size_x * world.size_y, 1))
+        self.world.use_buffer(self.shared_memory.buf)
+
+        # Workers are spawned instead of forked. Forking a process that already runs other threads (pygame, the cast
+        # worker) can copy a held lock into the child and deadlock it.
+        self.pool = multiprocessing.get_context("spawn").Pool(
+            self.process_amount, initializer=_initialize_worker,
+            initargs=(self.shared_memory.name, world.size_x, world.size_y))
+        logger.info("Started %s casting processes.", self.process_amount)
+
+    @property
+    def grid(self):
+        return self.world.grid
+
+    @property
+    def floor_grid(self):
+        return self.world.floor_grid
+
+    def cast_rays(self, origins, angles, directions=None, max_distances=None):
+        """
+        Cast a batch of rays in parallel
+        :param origins: Array of shape (n, 2) with the start positions (x, y) of every ray
+        :param angles: Array of shape (n,) with the angle of every ray in degrees
+        :param directions: Optional precomputed (x, y) direction arrays of the rays
+        :param max_distances: Optional array of shape (n,) with the length of every ray, see GridWorld.cast_rays
+        :return: Ray cast result dictionary of GridWorld.cast_rays, in the same order as the given rays
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1)
+
+        if angles.shape[0] == 0:
+            return self.world.cast_rays(origins, angles, directions, max_distances)
+
+        if directions is not None:
+            directions = tuple(np.asarray(direction, dtype=np.float64).reshape(-1) for direction in directions)
+        if max_distances is not None:
+            max_distances = np.broadcast_to(np.asarray(max_distances, dtype=np.float64), angles.shape)
+
+        bands = [band for band in np.array_split(np.arange(angles.shape[0]), self.band_amount) if band.size]
+        band_results = self.pool.starmap(_cast_band, [
+            (origins[band], angles[band],
+             None if directions is None else (directions[0][band], directions[1][band]),
+             None if max_distances is None else max_distances[band])
+            for band in bands])
+
+        return {key: np.concatenate([result[key] for result in band_results]) for key in band_results[0]}
+
+    def close(self):
+        """
+        Stop the workers and move the world cells back into regular memory
+        """
+        self.pool.terminate()
+        self.pool.join()
+        self.world.use_buffer(bytearray(self.world.size_x * self.world.size_y))
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,175 @@
+import cProfile
+import csv
+import json
+import pstats
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+import pygame
+
+
+class FrameProfiler:
+    """
+    Collects named stage timings for every frame and keeps rolling percentiles over the most recent frames. Can draw
+    an on-screen overlay, dump the recorded frames to CSV/JSON and run cProfile for a number of frames.
+    """
+
+    overlay_color = (255, 255, 0)
+    overlay_background = (20, 20, 20)
+
+    def __init__(self, history_length: int = 600):
+        self.history_length = history_length
+        self.show_overlay = False  # Toggles display of the overlay on screen
+
+        # Frame history. One dictionary of stage durations in seconds per frame, "frame" holds the total frame time.
+        self.frames = deque(maxlen=self.history_length)
+        self.current_frame = {}
+        self.frame_start = None
+
+        # cProfile hook
+        self.cprofile = None
+        self.thread_cprofiles = []  # Finished profiles of other threads, merged into the stats of self.cprofile
+        self.cprofile_frames_left = 0
+        self.cprofile_output_path = None
+
+    def start_frame(self):
+        self.current_frame = {}
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+
+        self.current_frame["frame"] = time.perf_counter() - self.frame_start
+        self.frames.append(self.current_frame)
+        self.frame_start = None
+
+        # Stop cProfile after the requested amount of frames
+        if self.cprofile is not None:
+            self.cprofile_frames_left -= 1
+            if self.cprofile_frames_left <= 0:
+                self.stop_cprofile()
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Measure the duration of a stage of the current frame. Repeated stages in one frame are added up.
+        :param name: name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, duration: float):
+        """
+        Add a duration that was measured elsewhere, e.g. on another thread, to a stage of the current frame
+        :param name: name of the stage
+        :param duration: duration in seconds
+        """
+        self.current_frame[name] = self.current_frame.get(name, 0) + duration
+
+    def stage_names(self):
+        names = []
+        for frame in self.frames:
+            for name in frame:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def percentiles(self, percentiles=(50, 95, 99)):
+        """
+        Rolling percentiles of every stage over the recorded frames
+        :param percentiles: percentiles to calculate
+        :return: Dictionary of stage name to dictionary of "p50", "p95", ... in seconds
+        """
+        stats = {}
+        for name in self.stage_names():
+            durations = np.fromiter((frame.get(name, 0) for frame in self.frames), dtype=np.float64)
+            values = np.percentile(durations, percentiles)
+            stats[name] = {f"p{percentile}": float(value) for percentile, value in zip(percentiles, values)}
+        return stats
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        print(f"[PROFILER] Overlay {'shown' if self.show_overlay else 'hidden'}.")
+
+    def draw_overlay(self, screen, font, position=(10, 460)):
+        """
+        Draw the p50/p95/p99 timings of all stages in milliseconds
+        :param screen: pygame screen to draw the overlay on
+        :param font: pygame font for the overlay text
+        :param position: top left position of the overlay on screen
+        """
+        if not self.show_overlay or not self.frames:
+            return
+
+        lines = ["stage            p50     p95     p99  (ms)"]
+        for name, values in self.percentiles().items():
+            lines.append(f"{name:<14}" + "".join(f"{value * 1000:8.2f}" for value in values.values()))
+
+        line_height = font.get_linesize()
+        text_surfaces = [font.render(line, False, FrameProfiler.overlay_color) for line in lines]
+        width = max(surface.get_width() for surface in text_surfaces) + 10
+
+        pygame.draw.rect(screen, FrameProfiler.overlay_background, (position, (width, line_height * len(lines) + 10)))
+        for index, surface in enumerate(text_surfaces):
+            screen.blit(surface, (position[0] + 5, position[1] + 5 + index * line_height))
+
+    def dump(self, path: str):
+        """
+        Write the recorded frames and percentiles to a file. Files ending with .csv get one row per frame, all other
+        files are written as JSON.
+        :param path: output file path
+        """
+        names = self.stage_names()
+
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(names)
+                for frame in self.frames:
+                    writer.writerow([frame.get(name, 0) for name in names])
+        else:
+            with open(path, "w") as file:
+                json.dump({"percentiles": self.percentiles(), "frames": list(self.frames)}, file, indent=2)
+
+        print(f"[PROFILER] {len(self.frames)} frames written to {path}.")
+
+    def start_cprofile(self, frame_amount: int, output_path: str = "frames.prof"):
+        """
+        Run cProfile for the next frames. The stats are written to output_path and the top entries are printed.
+        cProfile only records the main thread, work of other threads is included if they hand in their own profiles
+        through add_cprofile (see CastWorker).
+        :param frame_amount: amount of frames to profile
+        :param output_path: file for the pstats output
+        """
+        if self.cprofile is not None:
+            return
+
+        self.cprofile = cProfile.Profile()
+        self.cprofile_frames_left = frame_amount
+        self.cprofile_output_path = output_path
+        self.cprofile.enable()
+        print(f"[PROFILER] Profiling {frame_amount} frames.")
+
+    def add_cprofile(self, cprofile):
+        """
+        Merge a finished (disabled) profile of another thread into the running cProfile stats
+        """
+        if self.cprofile is not None:
+            self.thread_cprofiles.append(cprofile)
+
+    def stop_cprofile(self):
+        self.cprofile.disable()
+        stats = pstats.Stats(self.cprofile)
+        if self.thread_cprofiles:
+            stats.add(*self.thread_cprofiles)
+        stats.dump_stats(self.cprofile_output_path)
+        stats.sort_stats("cumulative").print_stats(15)
+        print(f"[PROFILER] Profile written to {self.cprofile_output_path} "
+              f"({len(self.thread_cprofiles)} profiles of other threads merged).")
+        self.cprofile = None
+        self.thread_cprofiles = []
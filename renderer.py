@@ -0,0 +1,336 @@
+import numpy as np
+import pygame
+from trig_tables import get_angle_table, get_fov_table
+
+
+class FirstPersonRenderer:
+    """
+    Renders the first person view of a GridWorld. One ray is cast per screen column and all wall slices are written
+    into a pixel buffer in a single vectorized pass, which is then copied onto a pygame surface. With a texture atlas
+    the wall slices are sampled from textures selected by the hit cell values and floor and ceiling are cast per pixel
+    with textures selected by the floor materials of the world. Otherwise walls, floor and ceiling are flat colored.
+    Entity sprites of the texture atlas are drawn on top, depth tested against the wall distance of every column.
+    """
+
+    ceiling_color = (40, 40, 40)
+    floor_color = (90, 90, 90)
+    wall_colors = {1: (200, 200, 200)}
+    side_shading = 0.7  # Brightness of walls hit on a horizontal cell border
+
+    def __init__(self, width: int, height: int, fov_degrees: float = 60, texture_atlas=None):
+        self.width = width
+        self.height = height
+        self.fov = fov_degrees
+
+        # Pixel buffer of mapped 32 bit colors in pygame surfarray layout (x, y) and the surface it is copied to
+        self.surface = pygame.Surface((self.width, self.height), depth=32)
+        self.frame = np.zeros((self.width, self.height), dtype=np.uint32)
+
+        # Column angle offsets and fisheye correction, shared by all renderers with the same width and fov
+        self.fov_table = get_fov_table(self.width, self.fov)
+        self.column_angle_offsets = self.fov_table.column_angle_offsets
+        self.fisheye_correction = self.fov_table.fisheye_correction
+
+        # Wall color for every possible cell value, shaded copy for horizontal borders
+        wall_color_table = np.zeros((256, 2, 3), dtype=np.uint8)
+        for value, color in FirstPersonRenderer.wall_colors.items():
+            wall_color_table[value, 0] = color
+            wall_color_table[value, 1] = np.array(color) * FirstPersonRenderer.side_shading
+        self.wall_color_table = self.map_colors(wall_color_table)
+
+        # Ceiling and floor color of every row, copied into the pixel buffer at the start of every frame
+        self.row_indexes = np.arange(self.height)
+        background_column = self.map_colors(np.where((self.row_indexes < self.height // 2)[:, None],
+                                                     FirstPersonRenderer.ceiling_color,
+                                                     FirstPersonRenderer.floor_color))
+        self.background = np.broadcast_to(background_column, self.frame.shape)
+
+        # Textured frames are built as texture pixel index of every pixel, then converted in one lookup
+        self.texture_atlas = texture_atlas
+        if texture_atlas is not None:
+            texture_pixel_amount = 2 * texture_atlas.texture_size ** 2
+            self.texture_pixels = self.map_colors(texture_atlas.columns).reshape(-1)
+            self.pixel_indexes = np.zeros((self.width, self.height), dtype=np.int32)
+            self.floor_texture_starts = (texture_atlas.floor_textures * texture_pixel_amount).astype(np.int32)
+            self.ceiling_texture_starts = (texture_atlas.ceiling_textures * texture_pixel_amount).astype(np.int32)
+
+        # Perpendicular distance of the floor seen in every row below the horizon. A wall at distance d ends at row
+        # height / 2 + height / (2 * d), solved for d at the pixel row centers. The center of the middle row of odd
+        # heights lies on the horizon, it shows the floor at the center of its lower half instead.
+        self.horizon = self.height // 2
+        floor_rows = self.row_indexes[self.horizon:]
+        self.floor_row_distances = (self.height / np.maximum(2 * (floor_rows + 0.5) - self.height, 0.5)).astype(
+            np.float32)
+
+        # Ray length to reach a perpendicular distance of 1 in every column
+        self.column_ray_scale = (1 / self.fisheye_correction).astype(np.float32)
+
+        # Sprite pixels as mapped colors, their opaque masks and per pixel the last sprite pixel drawn on it. The
+        # first and end opaque row of every sprite column limit the drawn rows.
+        if texture_atlas is not None:
+            sprite_masks = texture_atlas.sprite_masks
+            self.sprite_pixels = self.map_colors(texture_atlas.sprites).reshape(-1)
+            self.sprite_masks = sprite_masks.reshape(-1)
+            self.sprite_owners = np.full(self.width * self.height, -1, dtype=np.int64)
+            any_opaque = sprite_masks.any(axis=2)
+            self.sprite_first_rows = np.where(any_opaque, sprite_masks.argmax(axis=2), 0)
+            self.sprite_end_rows = np.where(any_opaque, texture_atlas.texture_size -
+                                            sprite_masks[:, :, ::-1].argmax(axis=2), 0)
+
+        # Half width of the camera plane at distance 1 and the camera plane position of every column center
+        self.camera_plane_width = np.tan(np.radians(self.fov / 2))
+        self.column_plane_positions = np.tan(np.radians(self.column_angle_offsets))
+
+    def map_colors(self, colors):
+        """
+        Convert an array of rgb colors (last axis) to mapped colors of the render surface
+        """
+        colors = np.asarray(colors, dtype=np.uint32)
+        red_shift, green_shift, blue_shift, _ = self.surface.get_shifts()
+        return (colors[..., 0] << red_shift) | (colors[..., 1] << green_shift) | (colors[..., 2] << blue_shift)
+
+    def cast(self, world, pos_x: float, pos_y: float, angle_degrees: float):
+        """
+        Cast one ray per screen column from a player pose. Keeps no state in the renderer, so the next frame can be cast
+        while the last one is drawn.
+        :param world: GridWorld to cast the rays in
+        :param pos_x: player x position in cell units
+        :param pos_y: player y position in cell units
+        :param angle_degrees: player view direction
+        :return: Ray cast result dictionary of GridWorld.cast_rays. Also holds the ray origin, the view angle and the
+        ray directions, needed for floor casting, sprites and to orient the textures.
+        """
+        origins = np.broadcast_to((pos_x, pos_y), (self.width, 2))
+        ray_directions = self.fov_table.directions(angle_degrees)
+        ray_hits = world.cast_rays(origins, angle_degrees + self.column_angle_offsets, directions=ray_directions)
+        ray_hits["ray_origin"] = (pos_x, pos_y)
+        ray_hits["view_angle"] = angle_degrees
+        ray_hits["ray_directions"] = ray_directions
+        return ray_hits
+
+    def draw_walls(self, world, ray_hits):
+        """
+        Write the wall slices of all columns into the pixel buffer
+        :param world: GridWorld the rays were cast in
+        :param ray_hits: Ray cast result dictionary of cast with one ray per screen column
+        """
+
+        # Perpendicular distance to the camera plane removes the fisheye distortion
+        distances = ray_hits["distance"] * self.fisheye_correction
+        collided = np.isfinite(distances)
+
+        # Top and bottom row of the wall slice in every column
+        with np.errstate(divide="ignore"):
+            wall_heights = np.where(collided, self.height / distances, 0)
+        wall_tops = (self.height - wall_heights) / 2
+        wall_bottoms = wall_tops + wall_heights
+
+        cell_values = world.grid[np.where(collided, ray_hits["collided_cell_y"], 0),
+                                 np.where(collided, ray_hits["collided_cell_x"], 0)]
+        sides = np.maximum(ray_hits["side"], 0)
+
+        if self.texture_atlas is not None:
+            # Wall slices are symmetric around the horizon, so rows between the highest wall top and the lowest wall
+            # bottom are covered in every column and need no floor or ceiling
+            self.draw_floor(world, ray_hits, int(wall_bottoms.min()))
+            self.draw_textured_walls(ray_hits, collided, cell_values, sides, wall_tops, wall_heights)
+            np.take(self.texture_pixels, self.pixel_indexes, out=self.frame)
+            return
+
+        # Fill background, then the wall color per column from the hit cell value and hit side. All wall slices are
+        # written in one masked assignment.
+        np.copyto(self.frame, self.background)
+        column_colors = self.wall_color_table[cell_values, sides]
+        wall_mask = ((self.row_indexes >= wall_tops[:, None]) & (self.row_indexes < wall_bottoms[:, None]) &
+                     collided[:, None])
+        np.copyto(self.frame, column_colors[:, None], where=wall_mask)
+
+    def draw_floor(self, world, ray_hits, first_row: int = 0):
+        """
+        Floor and ceiling casting. Every row below the horizon shows the floor at one perpendicular distance, so the
+        world positions of all floor pixels are the outer product of the column ray directions and the row distances.
+        Ceiling rows mirror the floor rows. Writes texture pixel indexes into the pixel index buffer.
+        :param world: world with an optional floor_grid of floor materials, material 0 is used without. Positions
+        outside the world use the material of the closest edge cell.
+        :param ray_hits: Ray cast result dictionary of cast
+        :param first_row: first floor row that is not covered by a wall in every column
+        """
+        texture_size = self.texture_atlas.texture_size
+        texture_shift = texture_size.bit_length() - 1
+        first_row = max(first_row, self.horizon)
+        if first_row >= self.height:
+            return
+        pos_x, pos_y = ray_hits["ray_origin"]
+        direction_x, direction_y = ray_hits["ray_directions"]
+
+        # World position of every floor pixel (columns, floor rows) in fixed point texture pixel units. The cell is
+        # the upper bits, the texture pixel within the cell the lower bits.
+        row_distances = self.floor_row_distances[first_row - self.horizon:]
+        floor_x = np.multiply.outer((direction_x * self.column_ray_scale * texture_size).astype(np.float32),
+                                    row_distances)
+        floor_y = np.multiply.outer((direction_y * self.column_ray_scale * texture_size).astype(np.float32),
+                                    row_distances)
+        floor_x += np.float32(pos_x * texture_size)
+        floor_y += np.float32(pos_y * texture_size)
+        floor_x = floor_x.astype(np.int32)
+        floor_y = floor_y.astype(np.int32)
+
+        # Texture pixel offset, same for floor and ceiling
+        pixel_offsets = (floor_x & (texture_size - 1)) << texture_shift
+        pixel_offsets |= floor_y & (texture_size - 1)
+
+        # Floor material of the cell below every pixel
+        floor_grid = getattr(world, "floor_grid", None)
+        if floor_grid is None:
+            materials = 0
+        else:
+            size_y, size_x = floor_grid.shape
+            floor_x >>= texture_shift
+            floor_y >>= texture_shift
+            np.clip(floor_x, 0, size_x - 1, out=floor_x)
+            np.clip(floor_y, 0, size_y - 1, out=floor_y)
+            floor_y *= size_x
+            floor_y += floor_x
+            materials = np.take(floor_grid.reshape(-1), floor_y)
+
+        # Ceiling first, so the floor wins the middle row of odd heights
+        ceiling_indexes = self.ceiling_texture_starts[materials]
+        ceiling_indexes += pixel_offsets
+        self.pixel_indexes[:, :self.height - first_row] = ceiling_indexes[:, ::-1]
+        floor_indexes = self.floor_texture_starts[materials]
+        floor_indexes += pixel_offsets
+        self.pixel_indexes[:, first_row:] = floor_indexes
+
+    def draw_textured_walls(self, ray_hits, collided, cell_values, sides, wall_tops, wall_heights):
+        """
+        Sample one texture column per screen column, scaled to the wall slice height, into the pixel index buffer
+        """
+        atlas = self.texture_atlas
+        texture_size = atlas.texture_size
+        if not collided.any():
+            return
+
+        # Texture column from the hit offset along the wall face. Faces seen from the other side are mirrored so
+        # textures are not flipped depending on the view direction.
+        wall_offsets = np.where(collided, ray_hits["wall_offset"], 0)
+        direction_x, direction_y = ray_hits["ray_directions"]
+        mirrored = np.where(sides == 0, direction_x < 0, direction_y > 0)
+        wall_offsets = np.where(mirrored, 1 - wall_offsets, wall_offsets)
+        texture_x = np.minimum((wall_offsets * texture_size).astype(np.int64), texture_size - 1)
+
+        # Start of the selected texture column of every screen column in the flat texture pixels
+        column_starts = ((atlas.value_textures[cell_values] * 2 + sides) * texture_size + texture_x) * texture_size
+        column_starts = column_starts.astype(np.int32)
+
+        # Only rows covered by any wall slice are sampled
+        first_row = max(int(wall_tops[collided].min()), 0)
+        last_row = min(int(np.ceil((wall_tops + wall_heights)[collided].max())), self.height)
+        rows = self.row_indexes[first_row:last_row]
+
+        # Texture row of every pixel, scaled from the unclipped slice so close walls show the matching texture part.
+        # Per pixel math in float32 to halve the memory traffic.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            texture_y = ((rows.astype(np.float32) - wall_tops[:, None].astype(np.float32)) *
+                         (texture_size / wall_heights[:, None]).astype(np.float32))
+            wall_mask = (texture_y >= 0) & (texture_y < texture_size)
+            wall_indexes = column_starts[:, None] + texture_y.astype(np.int32)
+
+        # Wall slices cover the floor and ceiling in the pixel index buffer
+        np.copyto(self.pixel_indexes[:, first_row:last_row], wall_indexes, where=wall_mask)
+
+    def draw_sprites(self, ray_hits, entities):
+        """
+        Draw entity sprites into the pixel buffer. Every sprite is a one cell large billboard facing the camera, its
+        columns are depth tested against the wall distance of the column. All sprite pixels of the frame are gathered
+        and written at once, where sprites overlap the one drawn later wins.
+        :param ray_hits: Ray cast result dictionary of cast of the drawn frame
+        :param entities: visible entities sorted back to front, e.g. from EntityGrid.query_view
+        """
+        if self.texture_atlas is None or not entities:
+            return
+        texture_size = self.texture_atlas.texture_size
+
+        # Depth along the view direction and lateral offset to the right of it of every sprite center
+        pos_x, pos_y = ray_hits["ray_origin"]
+        view_x, view_y = get_angle_table().direction(ray_hits["view_angle"])
+        relative_x = np.array([entity.x for entity in entities]) - pos_x
+        relative_y = np.array([entity.y for entity in entities]) - pos_y
+        sprites = np.array([entity.sprite for entity in entities])
+        depths = relative_x * view_x + relative_y * view_y
+        laterals = relative_y * view_x - relative_x * view_y
+        in_front = depths > 0
+        depths, laterals, sprites = depths[in_front], laterals[in_front], sprites[in_front]
+
+        # Screen columns between the sprite edges. Column c covers the camera plane position of its center.
+        column_scale = self.width / (2 * self.camera_plane_width)
+        first_columns = np.ceil(((laterals - 0.5) / depths + self.camera_plane_width) * column_scale - 0.5)
+        end_columns = np.ceil(((laterals + 0.5) / depths + self.camera_plane_width) * column_scale - 0.5)
+        first_columns = np.clip(first_columns, 0, self.width).astype(np.int64)
+        end_columns = np.clip(end_columns, 0, self.width).astype(np.int64)
+
+        # One entry per sprite column, kept where the sprite is in front of the wall
+        column_sprites, columns = self.expand_ranges(first_columns, end_columns)
+        wall_distances = ray_hits["distance"] * self.fisheye_correction
+        in_front_of_wall = depths[column_sprites] < wall_distances[columns]
+        column_sprites, columns = column_sprites[in_front_of_wall], columns[in_front_of_wall]
+        texture_x = ((self.column_plane_positions[columns] * depths[column_sprites] - laterals[column_sprites] + 0.5) *
+                     texture_size).astype(np.int64)
+        texture_x = np.clip(texture_x, 0, texture_size - 1)
+
+        # Sprites are as high as a wall at the same distance. Only rows between the first and the last opaque
+        # pixel of the sprite column are drawn.
+        heights = self.height / depths
+        tops = (self.height - heights) / 2
+        texture_scale = heights[column_sprites] / texture_size
+        first_rows = tops[column_sprites] + self.sprite_first_rows[sprites[column_sprites], texture_x] * texture_scale
+        end_rows = tops[column_sprites] + self.sprite_end_rows[sprites[column_sprites], texture_x] * texture_scale
+        first_rows = np.clip(np.ceil(first_rows), 0, self.height).astype(np.int64)
+        end_rows = np.clip(np.ceil(end_rows), 0, self.height).astype(np.int64)
+
+        # One entry per sprite pixel
+        pixel_columns, rows = self.expand_ranges(first_rows, end_rows)
+        pixel_sprites = column_sprites[pixel_columns]
+        texture_y = ((rows - tops[pixel_sprites]) * (texture_size / heights[pixel_sprites])).astype(np.int64)
+        texture_y = np.clip(texture_y, 0, texture_size - 1)
+        sprite_pixel_indexes = ((sprites[pixel_sprites] * texture_size + texture_x[pixel_columns]) * texture_size +
+                                texture_y)
+
+        opaque = self.sprite_masks[sprite_pixel_indexes]
+        frame_indexes = columns[pixel_columns][opaque] * self.height + rows[opaque]
+        sprite_pixel_indexes = sprite_pixel_indexes[opaque]
+
+        # Resolve overlaps: every frame pixel takes the last sprite pixel drawn on it
+        draw_order = np.arange(frame_indexes.size)
+        np.maximum.at(self.sprite_owners, frame_indexes, draw_order)
+        drawn = self.sprite_owners[frame_indexes] == draw_order
+        self.sprite_owners[frame_indexes] = -1
+
+        self.frame.reshape(-1)[frame_indexes[drawn]] = self.sprite_pixels[sprite_pixel_indexes[drawn]]
+
+    @staticmethod
+    def expand_ranges(starts, ends):
+        """
+        Expand ranges into one entry per value
+        :param starts: array of range starts
+        :param ends: array of range ends (exclusive)
+        :return: arrays of the range index and the value of every entry
+        """
+        lengths = np.maximum(ends - starts, 0)
+        range_indexes = np.repeat(np.arange(lengths.size), lengths)
+        range_offsets = np.cumsum(lengths) - lengths
+        return range_indexes, starts[range_indexes] + np.arange(range_indexes.size) - range_offsets[range_indexes]
+
+    def render(self, world, pos_x: float, pos_y: float, angle_degrees: float, entities=None,
+               max_entity_distance: float = 32):
+        """
+        Cast and draw the complete first person view
+        :param entities: optional EntityGrid of entities to draw
+        :param max_entity_distance: entities further away are not drawn
+        :return: pygame surface with the rendered view
+        """
+        ray_hits = self.cast(world, pos_x, pos_y, angle_degrees)
+        self.draw_walls(world, ray_hits)
+        if entities is not None:
+            self.draw_sprites(ray_hits, entities.query_view(pos_x, pos_y, angle_degrees, self.fov, max_entity_distance))
+        pygame.surfarray.blit_array(self.surface, self.frame)
+        return self.surface
@@ -0,0 +1,89 @@
+from collections import deque
+import numpy as np
+import pygame
+from renderer import FirstPersonRenderer
+
+
+class AdaptiveResolution:
+    """
+    Renders the first person view at a scaled internal resolution (fewer rays, smaller pixel buffer) and upscales it
+    to the output size. The scale follows the measured frame times so a target frame budget is met: it steps down
+    when the frame time exceeds the budget and steps up when the expected frame time at the next larger scale still
+    fits the budget. Frame times are judged over a window of frames to keep single slow frames from changing the
+    scale.
+    """
+
+    scale_steps = (1.0, 0.85, 0.7, 0.55, 0.4, 0.3, 0.25)
+    upscale_headroom = 0.9  # Part of the frame budget the expected frame time may use before scaling up
+
+    def __init__(self, width: int, height: int, target_fps: float = 60, fov_degrees: float = 60, texture_atlas=None,
+                 window_length: int = 30, frame_time_percentile: float = 90):
+        self.width = width
+        self.height = height
+        self.target_fps = target_fps
+        self.frame_budget = 1 / target_fps
+        self.fov = fov_degrees
+        self.texture_atlas = texture_atlas
+        self.frame_time_percentile = frame_time_percentile
+        self.enabled = True  # Keeps the current scale when disabled
+
+        # Frame times since the last scale change
+        self.frame_times = deque(maxlen=window_length)
+
+        # One renderer per scale step, created when the step is first used
+        self.step = 0
+        self.renderers = {}
+        self.output_surface = pygame.Surface((self.width, self.height), depth=32)
+
+    @property
+    def scale(self):
+        return AdaptiveResolution.scale_steps[self.step]
+
+    @property
+    def renderer(self):
+        """
+        First person renderer of the current scale
+        """
+        if self.step not in self.renderers:
+            self.renderers[self.step] = FirstPersonRenderer(max(round(self.width * self.scale), 1),
+                                                            max(round(self.height * self.scale), 1),
+                                                            self.fov, texture_atlas=self.texture_atlas)
+        return self.renderers[self.step]
+
+    def upscale(self, surface):
+        """
+        Scale a rendered view to the output size
+        :param surface: surface of the current renderer
+        :return: surface of the output size
+        """
+        if surface.get_size() == (self.width, self.height):
+            return surface
+        return pygame.transform.scale(surface, (self.width, self.height), self.output_surface)
+
+    def update(self, frame_time: float):
+        """
+        Record the duration of a frame and change the scale once a full window of frames is over or well under the
+        frame budget
+        :param frame_time: time the frame took in seconds, without waiting for the frame rate limit
+        """
+        self.frame_times.append(frame_time)
+        if not self.enabled or len(self.frame_times) < self.frame_times.maxlen:
+            return
+
+        frame_time = np.percentile(self.frame_times, self.frame_time_percentile)
+
+        # The frame time is expected to grow with the pixel amount, so with the square of the scale
+        if frame_time > self.frame_budget and self.step < len(AdaptiveResolution.scale_steps) - 1:
+            self.step += 1
+        elif self.step > 0 and (frame_time * (AdaptiveResolution.scale_steps[self.step - 1] / self.scale) ** 2 <
+                                self.frame_budget * AdaptiveResolution.upscale_headroom):
+            self.step -= 1
+        else:
+            return
+
+        self.frame_times.clear()
+        print(f"[QUALITY] Render scale set to {self.scale:.0%} ({self.renderer.width}x{self.renderer.height}).")
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        print(f"[QUALITY] Adaptive resolution {'enabled' if self.enabled else 'disabled'}.")
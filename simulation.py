@@ -0,0 +1,88 @@
+import math
+from trig_tables import get_angle_table
+
+
+class Simulation:
+    """
+    Updates the game state in fixed time steps, independent of the frame rate. The time of every frame is added to an
+    accumulator and as many steps are run as fit into it. Frames are drawn from the player pose interpolated between
+    the last two steps, so movement stays smooth at any frame rate and the game behaves the same on every machine.
+    """
+
+    move_speed = 3  # Cells per second
+    turn_speed = 120  # Degrees per second
+    player_radius = 0.2  # Half side length of the square the player occupies, in cells
+    max_frame_time = 0.25  # Longer frames are cut, so a stalled frame does not trigger a burst of steps
+
+    def __init__(self, world, player_x: float, player_y: float, player_angle: float, step_time: float = 1 / 120):
+        self.world = world
+        self.step_time = step_time
+        self.accumulator = 0
+
+        # Player pose after the last step and before it
+        self.player_x, self.player_y, self.player_angle = player_x, player_y, player_angle
+        self.previous_pose = (player_x, player_y, player_angle)
+
+    def advance(self, frame_time: float, forward: float = 0, strafe: float = 0, turn: float = 0):
+        """
+        Run all steps that fit into the time since the last frame
+        :param frame_time: time since the last frame in seconds
+        :param forward: forward (1) or backward (-1) movement input
+        :param strafe: right (1) or left (-1) movement input
+        :param turn: clockwise (1) or counterclockwise (-1) turn input
+        :return: amount of steps run
+        """
+        self.accumulator += min(frame_time, Simulation.max_frame_time)
+
+        step_amount = 0
+        while self.accumulator >= self.step_time:
+            self.step(forward, strafe, turn)
+            self.accumulator -= self.step_time
+            step_amount += 1
+        return step_amount
+
+    def step(self, forward: float = 0, strafe: float = 0, turn: float = 0):
+        """
+        Advance the game state by one fixed time step
+        """
+        self.previous_pose = (self.player_x, self.player_y, self.player_angle)
+
+        self.player_angle += turn * Simulation.turn_speed * self.step_time
+        direction_x, direction_y = get_angle_table().direction(self.player_angle)
+
+        # Strafing moves along the view direction rotated by 90 degrees
+        distance = Simulation.move_speed * self.step_time
+        self.move_player((forward * direction_x - strafe * direction_y) * distance,
+                         (forward * direction_y + strafe * direction_x) * distance)
+
+    def move_player(self, move_x: float, move_y: float):
+        """
+        Move the player with collision against the world. Both axes are moved separately, so the player slides along
+        walls instead of stopping. A player that is already inside a wall, e.g. after the cell was painted, can move.
+        """
+        stuck = self.collides(self.player_x, self.player_y)
+        if stuck or not self.collides(self.player_x + move_x, self.player_y):
+            self.player_x += move_x
+        if stuck or not self.collides(self.player_x, self.player_y + move_y):
+            self.player_y += move_y
+
+    def collides(self, pos_x: float, pos_y: float):
+        """
+        Check if the player square at a position overlaps a non empty cell or leaves the world
+        """
+        radius = Simulation.player_radius
+        start_x, end_x = math.floor(pos_x - radius), math.floor(pos_x + radius)
+        start_y, end_y = math.floor(pos_y - radius), math.floor(pos_y + radius)
+
+        if start_x < 0 or start_y < 0 or end_x >= self.world.size_x or end_y >= self.world.size_y:
+            return True
+        return bool(self.world.grid[start_y:end_y + 1, start_x:end_x + 1].any())
+
+    def pose(self):
+        """
+        Player pose to draw, interpolated between the last two steps by the time left in the accumulator
+        :return: (x, y, angle)
+        """
+        alpha = self.accumulator / self.step_time
+        return tuple(previous + (current - previous) * alpha for previous, current in
+                     zip(self.previous_pose, (self.player_x, self.player_y, self.player_angle)))
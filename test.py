@@ -1 +1,162 @@
-print(120 % 360)
\ No newline at end of file
+import os
+import struct
+import tempfile
+import warnings
+import numpy as np
+from world import GridWorld
+from renderer import FirstPersonRenderer
+from textures import TextureAtlas
+from occupancy_pyramid import OccupancyPyramid
+import world_file
+from visibility import PotentiallyVisibleSet, line_of_sight
+from matplotlib_version.grid_world import GridWorld as PlotGridWorld
+
+
+def random_world(size: int, wall_density: float, seed: int):
+    rng = np.random.default_rng(seed)
+    world = GridWorld(size, size)
+    world.set_value_array(0, 0, (rng.random((size, size)) < wall_density).astype(np.uint8))
+    return world, rng
+
+
+def random_rays(world: GridWorld, rng, ray_amount: int):
+    # Rays starting in empty cells, a quarter of them axis aligned
+    empty_y, empty_x = np.nonzero(world.grid == 0)
+    cells = rng.integers(0, empty_x.size, ray_amount)
+    origins = np.column_stack([empty_x[cells], empty_y[cells]]) + rng.uniform(0, 1, (ray_amount, 2))
+    angles = rng.uniform(0, 360, ray_amount)
+    angles[:ray_amount // 4] = rng.integers(0, 4, ray_amount // 4) * 90
+    return origins, angles
+
+
+def test_pyramid_matches_dda():
+    # Same hits as the plain DDA, also after the incremental updates of cell changes
+    world, rng = random_world(96, 0.05, 1)
+    pyramid = OccupancyPyramid(world)
+
+    for _ in range(3):
+        origins, angles = random_rays(world, rng, 5000)
+        origins[:1000] = np.floor(origins[:1000])  # Cell corners, rays through lattice points on diagonals
+        angles[:1000] = rng.integers(0, 8, 1000) * 45
+        expected, result = world.cast_rays(origins, angles), pyramid.cast_rays(origins, angles)
+        for key in ("collided_cell_x", "collided_cell_y", "side"):
+            assert np.array_equal(result[key], expected[key])
+        assert np.allclose(result["distance"], expected["distance"], equal_nan=True)
+
+        for (pos_x, pos_y), angle in zip(origins[:50], angles[:50]):
+            expected, result = world.calc_distance(pos_x, pos_y, angle), pyramid.calc_distance(pos_x, pos_y, angle)
+            assert (result["collided_cell_x"], result["collided_cell_y"]) == (expected["collided_cell_x"],
+                                                                              expected["collided_cell_y"])
+
+        world.set_value_list(np.column_stack([rng.integers(0, 96, (30, 2)), rng.integers(0, 2, 30)]))
+        world.set_value_block(*rng.integers(0, 80, 2), 16, 8, int(rng.integers(0, 2)))
+        world.set_value(*rng.integers(0, 96, 2), 1)
+
+
+def test_world_file_round_trip():
+    # Cells and floor materials survive save and load, also with a padded last chunk and for version 1 files
+    world, rng = random_world(45, 0.3, 3)
+    world.set_value_array(0, 0, rng.integers(0, 256, (45, 45)))
+    world.floor_grid[:] = rng.integers(0, 256, (45, 45))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "world.bin")
+        world_file.save_world(world, path, chunk_rows=16)
+        header = world_file.read_header(path)
+        assert (header["version"], header["size_x"], header["size_y"], header["chunk_rows"]) == (2, 45, 45, 16)
+        assert os.path.getsize(path) == world_file.HEADER_SIZE + 2 * 48 * 45
+
+        loaded = world_file.load_world(path)
+        assert np.array_equal(loaded.grid, world.grid)
+        assert np.array_equal(loaded.floor_grid, world.floor_grid)
+
+        # Version 1: header and the cell layer only
+        path = os.path.join(directory, "world_v1.bin")
+        with open(path, "wb") as file:
+            file.write(struct.pack(world_file.HEADER_FORMAT, world_file.MAGIC, 1, 45, 45, 100, 16).ljust(
+                world_file.HEADER_SIZE, b"\0"))
+            file.write(world.grid.tobytes().ljust(48 * 45, b"\0"))
+
+        loaded = world_file.load_world(path)
+        assert np.array_equal(loaded.grid, world.grid)
+        assert not loaded.floor_grid.any()
+
+
+def test_ray_cache_matches_fresh_cast():
+    # Cached rays that were not invalidated by cell changes must still hit what a fresh cast hits
+    rng = np.random.default_rng(2)
+    world = PlotGridWorld(40, 30, cell_size=100)
+    world.set_value_array(0, 0, (rng.random((30, 40)) < 0.08).astype(np.uint8))
+    world.set_value_border(1)
+    world.set_value_block(19, 14, 2, 2, 0)
+    for angle in np.arange(0, 360, 0.5):
+        world.add_ray(2000, 1500, angle)
+
+    for _ in range(4):
+        world.update_rays()
+        origins = [(ray.start_x, ray.start_y) for ray in world.rays]
+        expected = world.cast_rays(origins, [ray.angle for ray in world.rays])
+        assert [ray.collided_cell_x for ray in world.rays] == expected["collided_cell_x"].tolist()
+        assert [ray.collided_cell_y for ray in world.rays] == expected["collided_cell_y"].tolist()
+
+        edits = np.column_stack([rng.integers(1, 39, 10), rng.integers(1, 29, 10), rng.integers(0, 2, 10)])
+        world.set_value_list(edits)
+        world.set_value_block(*rng.integers(1, 30, 2), 3, 2, int(rng.integers(0, 2)))
+        world.toggle_value(*rng.integers(1, 29, 2))
+        world.set_value_block(19, 14, 2, 2, 0)  # Keep the ray origin empty
+
+
+def test_floor_casting_odd_height():
+    # The middle row of odd heights lies on the horizon, it must still sample a floor texel without warnings
+    world = GridWorld(16, 16)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        renderer = FirstPersonRenderer(64, 49, texture_atlas=TextureAtlas.default())
+        for angle in (0, 20, 135):
+            renderer.pixel_indexes.fill(-1)
+            renderer.render(world, 8.3, 8.6, angle)
+            assert (renderer.pixel_indexes >= 0).all()
+
+
+def test_pvs_matches_line_of_sight():
+    # The table may only skip traces of pairs that really can not see each other, also after cell changes
+    world, rng = random_world(64, 0.12, 0)
+    world.set_value_block(0, 31, 64, 1, 1)
+    world.set_value_block(20, 31, 2, 1, 0)
+    pvs = PotentiallyVisibleSet(world, region_size=8, max_distance=24)
+
+    culled = 0
+    for _ in range(3):
+        starts = rng.uniform(0, 64, (20000, 2))
+        ends = starts + rng.uniform(-24, 24, (20000, 2))
+        ends[:2000] = np.floor(ends[:2000])  # Cell corners
+        assert np.array_equal(pvs.can_see(starts, ends), line_of_sight(world, starts, ends))
+        culled += np.count_nonzero(~pvs.potentially_visible(starts, ends))
+
+        world.set_value_list(np.column_stack([rng.integers(0, 64, (20, 2)), rng.integers(0, 2, 20)]))
+        world.set_value_block(*rng.integers(0, 60, 2), 4, 4, 0)
+
+    assert culled > 0
+
+    # Rooms with all tables checked, the tables also prove occlusion of positions in empty cells
+    world = GridWorld(48, 48)
+    world.set_value_block(0, 15, 48, 2, 1)
+    world.set_value_block(23, 0, 2, 48, 1)
+    world.set_value_block(8, 15, 3, 2, 0)
+    world.set_value_block(23, 30, 2, 3, 0)
+    pvs = PotentiallyVisibleSet(world, region_size=8, max_distance=24)
+    pvs.build()
+    starts = rng.uniform(0, 48, (20000, 2))
+    ends = starts + rng.uniform(-24, 24, (20000, 2))
+    assert np.array_equal(pvs.can_see(starts, ends), line_of_sight(world, starts, ends))
+    in_empty_cells = (ends >= 0).all(axis=1) & (ends < 48).all(axis=1)
+    in_empty_cells[in_empty_cells] = world.grid[ends[in_empty_cells, 1].astype(int),
+                                                ends[in_empty_cells, 0].astype(int)] == 0
+    assert np.count_nonzero(~pvs.potentially_visible(starts, ends)[in_empty_cells]) > 0
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"[TEST] {name} passed.")
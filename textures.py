@@ -0,0 +1,134 @@
+import numpy as np
+import pygame
+
+
+class TextureAtlas:
+    """
+    All wall textures in one contiguous array of shape (textures, 2, size, size, rgb). Textures are stored column by
+    column in pygame surfarray layout (x, y), so atlas.columns[texture, side, x] is one ready sliced texture column.
+    Side 1 holds a darker copy for walls hit on a horizontal cell border. Cell values select the wall texture through
+    value_textures, values without an own texture use the plain texture 0. Floor material values of the world select
+    the floor and ceiling textures through floor_textures and ceiling_textures. Entity sprites are kept the same way
+    in sprites, with a mask of their opaque pixels.
+    """
+
+    plain_color = (200, 200, 200)
+    side_shading = 0.7  # Brightness of walls hit on a horizontal cell border
+
+    def __init__(self, texture_size: int = 64):
+        if texture_size < 1 or texture_size & (texture_size - 1):
+            raise ValueError(f"Texture size must be a power of two, got {texture_size}.")
+        self.texture_size = texture_size
+        self.columns = np.zeros((0, 2, texture_size, texture_size, 3), dtype=np.uint8)
+        self.value_textures = np.zeros(256, dtype=np.int64)  # Texture index of every cell value
+        self.floor_textures = np.zeros(256, dtype=np.int64)  # Texture index of every floor material
+        self.ceiling_textures = np.zeros(256, dtype=np.int64)
+        self.sprites = np.zeros((0, texture_size, texture_size, 3), dtype=np.uint8)
+        self.sprite_masks = np.zeros((0, texture_size, texture_size), dtype=bool)
+
+        # Plain fallback texture 0
+        self.add_texture(0, np.full((texture_size, texture_size, 3), TextureAtlas.plain_color, dtype=np.uint8))
+
+    def add_texture(self, value: int, pixels):
+        """
+        Add a texture for a cell value. Textures should be added once while loading, every call grows the atlas.
+        :param value: cell value that uses the texture as wall texture, None to only add the texture
+        :param pixels: array of shape (width, height, rgb) in surfarray layout, scaled to the atlas texture size
+        :return: texture index, can be assigned to floor_textures and ceiling_textures
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.shape[:2] != (self.texture_size, self.texture_size):
+            surface = pygame.surfarray.make_surface(pixels)
+            surface = pygame.transform.smoothscale(surface, (self.texture_size, self.texture_size))
+            pixels = pygame.surfarray.array3d(surface)
+
+        texture = np.stack([pixels, (pixels * TextureAtlas.side_shading).astype(np.uint8)])
+        self.columns = np.concatenate([self.columns, texture[None]])
+        if value is not None:
+            self.value_textures[value] = self.columns.shape[0] - 1
+        return self.columns.shape[0] - 1
+
+    def load_texture(self, value, path: str):
+        """
+        Load an image file as texture for a cell value
+        :return: texture index
+        """
+        return self.add_texture(value, pygame.surfarray.array3d(pygame.image.load(path)))
+
+    def add_sprite(self, pixels, mask=None):
+        """
+        Add an entity sprite. Sprites of another size are scaled to the atlas texture size by nearest neighbour, so
+        the mask stays sharp.
+        :param pixels: array of shape (width, height, rgb) in surfarray layout
+        :param mask: boolean array of shape (width, height), True for opaque pixels. All pixels are opaque without.
+        :return: sprite index
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        mask = np.ones(pixels.shape[:2], dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+        source_x = np.arange(self.texture_size) * pixels.shape[0] // self.texture_size
+        source_y = np.arange(self.texture_size) * pixels.shape[1] // self.texture_size
+        self.sprites = np.concatenate([self.sprites, pixels[np.ix_(source_x, source_y)][None]])
+        self.sprite_masks = np.concatenate([self.sprite_masks, mask[np.ix_(source_x, source_y)][None]])
+        return self.sprites.shape[0] - 1
+
+    def load_sprite(self, path: str):
+        """
+        Load an image file as entity sprite. Pixels with an alpha below 50% are transparent.
+        :return: sprite index
+        """
+        surface = pygame.image.load(path)
+        return self.add_sprite(pygame.surfarray.array3d(surface), pygame.surfarray.array_alpha(surface) >= 128)
+
+    @classmethod
+    def default(cls, texture_size: int = 64):
+        """
+        Atlas with generated textures for cell values 1 (bricks), 2 (stone tiles) and 3 (wood planks). Floor material
+        0 has dark tiles and a plank ceiling, floor material 1 sand and a stone ceiling. Sprite 0 is a green orb, sprite
+        1 a barrel.
+        """
+        atlas = cls(texture_size)
+        x, y = np.meshgrid(np.arange(texture_size), np.arange(texture_size), indexing="ij")
+        brick_height = max(texture_size // 8, 1)
+        brick_width = max(texture_size // 4, 1)
+
+        # Bricks with mortar lines, every second row shifted by half a brick
+        row_shift = (y // brick_height % 2) * (brick_width // 2)
+        mortar = (y % brick_height == 0) | ((x + row_shift) % brick_width == 0)
+        bricks = np.where(mortar[..., None], (180, 180, 170), (150, 60, 45))
+
+        # Stone tiles in a checker pattern
+        tile_size = max(texture_size // 4, 1)
+        checker = (x // tile_size + y // tile_size) % 2
+        stone = np.where(checker[..., None], (120, 120, 125), (95, 95, 100))
+
+        # Wood planks with dark gaps between them
+        plank_gap = x % max(texture_size // 4, 1) == 0
+        wood = np.where(plank_gap[..., None], (70, 45, 20), (150, 105, 55))
+
+        texture_indexes = [atlas.add_texture(value, pixels) for value, pixels in ((1, bricks), (2, stone), (3, wood))]
+
+        # Dark floor tiles and grainy sand
+        floor_tiles = np.where(checker[..., None], (70, 70, 75), (55, 55, 60))
+        grain = np.random.default_rng(0).integers(-12, 12, (texture_size, texture_size, 1))
+        sand = np.clip(np.array((165, 145, 100)) + grain, 0, 255)
+
+        atlas.floor_textures[0] = atlas.add_texture(None, floor_tiles)
+        atlas.floor_textures[1] = atlas.add_texture(None, sand)
+        atlas.ceiling_textures[0] = texture_indexes[2]
+        atlas.ceiling_textures[1] = texture_indexes[1]
+
+        # Shaded orb floating at eye height
+        center = (texture_size - 1) / 2
+        orb_distance = np.hypot(x - center, y - center) / (texture_size / 4)
+        orb_light = np.clip(1.2 - np.hypot(x - center * 0.8, y - center * 0.8) / (texture_size / 3), 0.3, 1)
+        atlas.add_sprite(np.array((60, 220, 90)) * orb_light[..., None], orb_distance <= 1)
+
+        # Barrel standing on the floor, darker at the sides and with two hoops
+        barrel_mask = (np.abs(x - center) <= texture_size * 0.3) & (y >= texture_size * 0.45)
+        barrel_light = 1 - (np.abs(x - center) / (texture_size * 0.3)) ** 2 * 0.6
+        hoop_width = texture_size / 32
+        hoops = (np.abs(y - texture_size * 0.6) < hoop_width) | (np.abs(y - texture_size * 0.88) < hoop_width)
+        barrel = np.where(hoops[..., None], (60, 60, 60), (130, 80, 35)) * barrel_light[..., None]
+        atlas.add_sprite(barrel, barrel_mask)
+        return atlas
@@ -0,0 +1,103 @@
+import math
+from functools import lru_cache
+import numpy as np
+
+
+class AngleTable:
+    """
+    Precomputed sine and cosine over the full circle at a fixed angular resolution. Angles that fall exactly on a table
+    entry are looked up instead of recomputed, other angles fall back to numpy/math.
+    """
+
+    def __init__(self, steps_per_degree: int = 10):
+        self.steps_per_degree = steps_per_degree
+        self.steps = 360 * steps_per_degree
+
+        angles_radians = np.radians(np.arange(self.steps) / steps_per_degree)
+        self.sin = np.sin(angles_radians)
+        self.cos = np.cos(angles_radians)
+
+        # Snap values that are zero in theory, so axis aligned rays never step on the other axis
+        self.sin[np.arange(0, self.steps, 180 * steps_per_degree)] = 0
+        self.cos[np.arange(90 * steps_per_degree, self.steps, 180 * steps_per_degree)] = 0
+
+        # Plain list copies, indexing them is faster than numpy for single values
+        self.sin_values = self.sin.tolist()
+        self.cos_values = self.cos.tolist()
+
+    def get_indexes(self, angles_degrees):
+        """
+        Table indexes of angles
+        :param angles_degrees: array of angles in degrees
+        :return: Array of table indexes and boolean array that is True where the angle is exactly on a table entry
+        """
+        steps = np.asarray(angles_degrees, dtype=np.float64) * self.steps_per_degree
+        rounded_steps = np.rint(steps)
+        return rounded_steps.astype(np.int64) % self.steps, rounded_steps == steps
+
+    def directions(self, angles_degrees):
+        """
+        Direction vectors of angles, looked up where possible
+        :param angles_degrees: array of angles in degrees
+        :return: Arrays of cosine and sine of the angles
+        """
+        indexes, on_table = self.get_indexes(angles_degrees)
+        if on_table.all():
+            return self.cos[indexes], self.sin[indexes]
+
+        angles_radians = np.radians(angles_degrees)
+        return (np.where(on_table, self.cos[indexes], np.cos(angles_radians)),
+                np.where(on_table, self.sin[indexes], np.sin(angles_radians)))
+
+    def direction(self, angle_degrees: float):
+        """
+        Direction vector of a single angle, looked up if the angle is on a table entry
+        :return: Cosine and sine of the angle
+        """
+        steps = angle_degrees * self.steps_per_degree
+        if steps == int(steps):
+            index = int(steps) % self.steps
+            return self.cos_values[index], self.sin_values[index]
+
+        angle_radians = math.radians(angle_degrees)
+        return math.cos(angle_radians), math.sin(angle_radians)
+
+
+class FovTable:
+    """
+    Per column values of a field of view that stay the same every frame: the angle offset of every column to the view
+    direction, the fisheye correction factor and the column direction relative to the view direction. Columns are
+    spread evenly over a flat camera plane.
+    """
+
+    def __init__(self, column_amount: int, fov_degrees: float):
+        self.column_amount = column_amount
+        self.fov = fov_degrees
+
+        camera_plane = ((2 * (np.arange(column_amount) + 0.5) / column_amount - 1) *
+                        math.tan(math.radians(fov_degrees / 2)))
+        self.column_angle_offsets = np.degrees(np.arctan(camera_plane))
+        self.fisheye_correction = np.cos(np.radians(self.column_angle_offsets))
+        self.column_cos = self.fisheye_correction
+        self.column_sin = np.sin(np.radians(self.column_angle_offsets))
+
+    def directions(self, view_angle_degrees: float):
+        """
+        Ray direction of every column. The precomputed column directions are rotated by the view direction, so only
+        one sine and cosine are needed per frame.
+        :param view_angle_degrees: view direction in degrees
+        :return: Arrays of the x and y direction of every column
+        """
+        view_cos, view_sin = get_angle_table().direction(view_angle_degrees)
+        return (view_cos * self.column_cos - view_sin * self.column_sin,
+                view_sin * self.column_cos + view_cos * self.column_sin)
+
+
+@lru_cache(maxsize=None)
+def get_angle_table(steps_per_degree: int = 10):
+    return AngleTable(steps_per_degree)
+
+
+@lru_cache(maxsize=32)
+def get_fov_table(column_amount: int, fov_degrees: float):
+    return FovTable(column_amount, fov_degrees)
@@ -0,0 +1,714 @@
+import math
+import numpy as np
+from world import GridWorld
+
+
+def line_of_sight(world: GridWorld, starts, ends):
+    """
+    Batched point to point line of sight checks. All segments are stepped through the grid together with the batch
+    DDA of GridWorld.cast_rays and stop at their end point. Positions are in cell units.
+    :param world: GridWorld to check in
+    :param starts: Array of shape (n, 2) with the start positions (x, y)
+    :param ends: Array of shape (n, 2) with the end positions (x, y)
+    :return: Boolean array of shape (n,), True where no non empty cell lies between start and end
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    deltas = ends - starts
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+
+    # Unit directions, any direction for segments without length
+    with np.errstate(divide="ignore", invalid="ignore"):
+        directions = np.where(lengths[:, None] > 0, deltas / lengths[:, None], (1, 0))
+
+    ray_hits = world.cast_rays(starts, np.degrees(np.arctan2(deltas[:, 1], deltas[:, 0])),
+                               directions=(directions[:, 0], directions[:, 1]), max_distances=lengths)
+    return ~np.isfinite(ray_hits["distance"])
+
+
+# Visibility states of piece pairs in the PotentiallyVisibleSet
+HIDDEN = 0  # No segment between both pieces is clear
+PARTIALLY_VISIBLE = 1  # Needs a trace
+VISIBLE = 2  # All segments between both pieces are clear
+
+
+class PotentiallyVisibleSet:
+    """
+    Precomputed visibility between pieces of empty space, so most "can A see B" queries are one table lookup. The
+    empty cells of every square region are split into rectangles (pieces) that never contain a wall. Every region
+    stores the visibility state of its pieces to all pieces of the regions within the max distance: hidden where
+    occlusion is proven for all segments between both pieces, visible where all of them are proven clear and partially
+    visible otherwise. Only partially visible pairs and queries the table can not answer (positions outside the world
+    or in non empty cells, regions out of range, pairs not checked yet) are traced, so can_see always gives the same
+    result as line_of_sight.
+
+    Segments that end in a non empty cell other than the start cell always hit it, these queries are hidden without a
+    table lookup.
+
+    All segments between two pieces lie in the convex hull of both rectangles. A pair is visible if the hull covers no
+    wall. A clear segment between sample points of both pieces makes a pair partially visible. Occlusion of the other
+    pairs is proven for the bundle of segments between both pieces: all lines of the bundle cross a column (or row)
+    only in walls or all pass the same wall. Bundles without such a column or wall are split and checked again. Pairs
+    that need too many splits stay partially visible.
+
+    Region tables are added when a query needs them, with all pairs partially visible. Every query checks at most
+    pairs_per_query pairs of the added tables, so cell changes and new regions never stall a query for long. build
+    checks all pairs at once, update with a pair budget can check them in idle time. Cell changes only drop the tables
+    of regions close enough for their pairs to pass the changed cells.
+    """
+
+    epsilon = 1e-6  # Margin for rounding errors of the DDA in cells
+    max_split_depth = 6  # Bundle splits per piece pair before it counts as partially visible
+    max_bundles = 8  # Unresolved bundles per piece pair before it counts as partially visible
+    batch_size = 512  # Piece pairs checked at once
+    pairs_per_query = 64  # Piece pairs checked per query at most
+    # Sample points of both pieces as fractions of their boxes (x, y), spread evenly without landing on cell borders
+    sample_fractions = ((np.arange(16)[:, None] * np.array([[0.618034, 0.754878], [0.569840, 0.824621]])[:, None] +
+                         0.1) % 1)
+
+    def __init__(self, world: GridWorld, region_size: int = 8, max_distance: float = 32):
+        if not 0 < region_size <= 15:
+            raise ValueError("Region size must be in range(1, 16).")  # Piece indexes of a region fit in one byte
+
+        self.world = world
+        self.region_size = region_size
+        self.max_distance = max_distance
+        self.regions_x = -(-world.size_x // region_size)
+        self.regions_y = -(-world.size_y // region_size)
+
+        # Region offsets (x, y) that can hold two positions within the max distance, with their index
+        self.reach = math.ceil(max_distance / region_size) + 1
+        offset_y, offset_x = np.mgrid[-self.reach:self.reach + 1, -self.reach:self.reach + 1]
+        in_range = (np.hypot(np.maximum(np.abs(offset_x) - 1, 0), np.maximum(np.abs(offset_y) - 1, 0)) * region_size
+                    <= max_distance)
+        self.offset_x, self.offset_y = offset_x[in_range], offset_y[in_range]
+        self.offset_index = np.full(in_range.shape, -1, dtype=np.int64)
+        self.offset_index[in_range] = np.arange(self.offset_x.size)
+
+        # Pieces of every region: amount, boxes (min x, min y, max x, max y) in cells and the piece index of every cell
+        # within its region, 255 for non empty cells
+        coordinate_type = np.min_scalar_type(max(world.size_x, world.size_y))
+        self.piece_counts = np.zeros((self.regions_y, self.regions_x), dtype=np.int64)
+        self.piece_boxes = np.zeros((self.regions_y, self.regions_x, region_size ** 2, 4), dtype=coordinate_type)
+        self.cell_pieces = np.full((world.size_y, world.size_x), 255, dtype=np.uint8)
+
+        # Region tables. The states of all pairs are kept in one array. Every region has a block of piece count rows,
+        # one column per piece of the regions in range. neighbor_starts holds the first column of the pieces of every
+        # region offset and the column amount.
+        self.states = np.zeros(0, dtype=np.uint8)
+        self.states_used = 0
+        self.states_unused = 0  # Entries of dropped tables, reclaimed when the array is full
+        self.table_starts = np.full((self.regions_y, self.regions_x), -1, dtype=np.int64)
+        self.table_sizes = np.zeros((self.regions_y, self.regions_x), dtype=np.int64)
+        self.table_checked = np.zeros((self.regions_y, self.regions_x), dtype=np.int64)  # Entries checked so far
+        self.neighbor_starts = np.zeros((self.regions_y, self.regions_x, self.offset_x.size + 1), dtype=np.int32)
+        self.requested = np.zeros((self.regions_y, self.regions_x), dtype=bool)
+
+        # Prefix sums of the walls in every column (columns, rows + 1) and every row (rows, columns + 1)
+        count_type = np.min_scalar_type(max(world.size_x, world.size_y))
+        self.column_walls = np.zeros((world.size_x, world.size_y + 1), dtype=count_type)
+        self.row_walls = np.zeros((world.size_y, world.size_x + 1), dtype=count_type)
+
+        # Columns, rows and regions with changed cells that were not updated yet
+        self.dirty_columns = np.ones(world.size_x, dtype=bool)
+        self.dirty_rows = np.ones(world.size_y, dtype=bool)
+        self.dirty_regions = np.ones((self.regions_y, self.regions_x), dtype=bool)
+
+        self.update(0)
+        world.on_change_functions.append(self._on_cell_changed)
+        world.on_region_change_functions.append(self._on_region_changed)
+
+    def build(self):
+        """
+        Compute the tables of all regions and check all their pairs at once instead of on demand. Also needed after the
+        grid was changed without the GridWorld set functions.
+        """
+        self.dirty_columns[:] = True
+        self.dirty_rows[:] = True
+        self.dirty_regions[:] = True
+        self.update(None)
+
+    def update(self, pair_budget: int = None):
+        """
+        Apply changed cells: update the wall counts and pieces and drop the tables of all regions that have a pair
+        passing a changed region. Then add the missing region tables queries asked for and check their pairs, the
+        tables added first before the others.
+        :param pair_budget: piece pairs checked at most, all missing tables are added and checked if None
+        """
+        grid = self.world.grid
+        columns = np.flatnonzero(self.dirty_columns)
+        if columns.size:
+            self.column_walls[columns, 1:] = np.cumsum(grid[:, columns] != 0, axis=0).T
+            self.dirty_columns[:] = False
+
+        rows = np.flatnonzero(self.dirty_rows)
+        if rows.size:
+            self.row_walls[rows, 1:] = np.cumsum(grid[rows] != 0, axis=1)
+            self.dirty_rows[:] = False
+
+        if self.dirty_regions.any():
+            # Pairs stay within the bounding box of both regions plus the rounding margin of one cell
+            dropped = self._dilate(self.dirty_regions, self.reach + 1) & (self.table_starts >= 0)
+            self.states_unused += int(self.table_sizes[dropped].sum())
+            self.table_starts[dropped] = -1
+            self.table_sizes[dropped] = 0
+            self.table_checked[dropped] = 0
+
+            for region_y, region_x in zip(*np.nonzero(self.dirty_regions)):
+                self._update_pieces(region_x, region_y)
+            self.dirty_regions[:] = False
+
+        missing = (self.table_starts < 0) & (self.piece_counts > 0)
+        regions_y, regions_x = np.nonzero(missing if pair_budget is None else missing & self.requested)
+        self._add_tables(regions_x, regions_y)
+        self.requested[:] = False
+        if pair_budget != 0:
+            self._check_tables(pair_budget)
+
+    @staticmethod
+    def _dilate(mask, radius: int):
+        # Mark all entries within radius (in rows and columns) of a marked entry, one axis after the other
+        for _ in range(2):
+            dilated = mask.copy()
+            for shift in range(1, min(radius, mask.shape[0] - 1) + 1):
+                dilated[shift:] |= mask[:-shift]
+                dilated[:-shift] |= mask[shift:]
+            mask = dilated.T
+        return mask
+
+    def _update_pieces(self, region_x: int, region_y: int):
+        # Split the empty cells of a region into rectangles, greedily in row order
+        size = self.region_size
+        start_x, start_y = region_x * size, region_y * size
+        empty = self.world.grid[start_y:start_y + size, start_x:start_x + size] == 0
+        pieces = self.cell_pieces[start_y:start_y + size, start_x:start_x + size]
+        pieces[:] = 255
+
+        boxes = []
+        if empty.all():
+            boxes.append((0, 0, empty.shape[1] - 1, empty.shape[0] - 1))
+            pieces[:] = 0
+
+        for y, x in zip(*np.nonzero(empty & (pieces == 255))):
+            if pieces[y, x] != 255:
+                continue
+            end_x = x + 1
+            while end_x < empty.shape[1] and empty[y, end_x] and pieces[y, end_x] == 255:
+                end_x += 1
+            end_y = y + 1
+            while end_y < empty.shape[0] and empty[end_y, x:end_x].all() and (pieces[end_y, x:end_x] == 255).all():
+                end_y += 1
+            pieces[y:end_y, x:end_x] = len(boxes)
+            boxes.append((x, y, end_x - 1, end_y - 1))
+
+        self.piece_counts[region_y, region_x] = len(boxes)
+        if boxes:
+            self.piece_boxes[region_y, region_x, :len(boxes)] = np.array(boxes) + (start_x, start_y, start_x, start_y)
+
+    @staticmethod
+    def _expand_ranges(lengths):
+        # Range index and position within the range of every entry of consecutive ranges
+        range_indexes = np.repeat(np.arange(lengths.size), lengths)
+        return range_indexes, np.arange(range_indexes.size) - (np.cumsum(lengths) - lengths)[range_indexes]
+
+    def _add_tables(self, regions_x, regions_y):
+        """
+        Add the tables of regions. All pairs start as partially visible, a piece sees all of itself.
+        :param regions_x: Array with the region column of every region
+        :param regions_y: Array with the region row of every region
+        """
+        if not len(regions_x):
+            return
+
+        # Columns of every region table: the pieces of all regions in range, ordered by region offset
+        other_x = regions_x[:, None] + self.offset_x
+        other_y = regions_y[:, None] + self.offset_y
+        in_world = (other_x >= 0) & (other_x < self.regions_x) & (other_y >= 0) & (other_y < self.regions_y)
+        other_counts = np.where(in_world, self.piece_counts[other_y.clip(0, self.regions_y - 1),
+                                                            other_x.clip(0, self.regions_x - 1)], 0)
+        neighbor_starts = np.zeros((len(regions_x), self.offset_x.size + 1), dtype=np.int64)
+        np.cumsum(other_counts, axis=1, out=neighbor_starts[:, 1:])
+        column_amounts = neighbor_starts[:, -1]
+
+        # Store the tables one after another
+        piece_counts = self.piece_counts[regions_y, regions_x]
+        table_sizes = piece_counts * column_amounts
+        table_starts = self._allocate_states(int(table_sizes.sum())) + np.cumsum(table_sizes) - table_sizes
+        self.states[table_starts[0]:table_starts[-1] + table_sizes[-1]] = PARTIALLY_VISIBLE
+        self.table_starts[regions_y, regions_x] = table_starts
+        self.table_sizes[regions_y, regions_x] = table_sizes
+        self.table_checked[regions_y, regions_x] = 0
+        self.neighbor_starts[regions_y, regions_x] = neighbor_starts
+
+        own_column = neighbor_starts[:, self.offset_index[self.reach, self.reach]]
+        table_indexes, pieces = self._expand_ranges(piece_counts)
+        self.states[table_starts[table_indexes] + pieces * column_amounts[table_indexes] + own_column[table_indexes] +
+                    pieces] = VISIBLE
+
+    def _check_tables(self, pair_budget: int = None):
+        """
+        Check the pairs of added tables that were not checked yet, the tables added first before the others
+        :param pair_budget: piece pairs checked at most, all if None
+        """
+        unchecked = np.nonzero((self.table_starts >= 0) & (self.table_checked < self.table_sizes))
+        order = np.argsort(self.table_starts[unchecked])
+        regions_y, regions_x = unchecked[0][order], unchecked[1][order]
+        firsts = self.table_checked[regions_y, regions_x]
+        amounts = self.table_sizes[regions_y, regions_x] - firsts
+        if pair_budget is not None:
+            amounts = np.minimum(amounts, np.maximum(pair_budget - (np.cumsum(amounts) - amounts), 0))
+
+        # Piece boxes and table entries of the pairs, row (piece of the region) after row
+        boxes_a, boxes_b, entries = [], [], []
+        for region_x, region_y, first, amount in zip(regions_x, regions_y, firsts, amounts):
+            if not amount:
+                break
+            neighbor_starts = self.neighbor_starts[region_y, region_x]
+            pieces, columns = np.divmod(np.arange(first, first + amount), neighbor_starts[-1])
+            offsets = np.searchsorted(neighbor_starts, columns, side="right") - 1
+            other_pieces = columns - neighbor_starts[offsets]
+            checked = ~((offsets == self.offset_index[self.reach, self.reach]) & (other_pieces == pieces))
+
+            boxes_a.append(self.piece_boxes[region_y, region_x, pieces[checked]])
+            boxes_b.append(self.piece_boxes[region_y + self.offset_y[offsets[checked]],
+                                            region_x + self.offset_x[offsets[checked]], other_pieces[checked]])
+            entries.append(self.table_starts[region_y, region_x] + np.arange(first, first + amount)[checked])
+            self.table_checked[region_y, region_x] += amount
+
+        if entries:
+            entries = np.concatenate(entries)
+            self.states[entries] = self._pair_states(np.concatenate(boxes_a).astype(np.int64),
+                                                     np.concatenate(boxes_b).astype(np.int64))
+
+    def _allocate_states(self, size: int):
+        # Start of a free block of states, compacts or grows the states array when it is full
+        if self.states_used + size > self.states.size:
+            # Keep the order of the tables, they are checked in the order they were added
+            computed = np.nonzero(self.table_starts >= 0)
+            order = np.argsort(self.table_starts[computed])
+            computed = (computed[0][order], computed[1][order])
+            old_starts, sizes = self.table_starts[computed], self.table_sizes[computed]
+            used = self.states_used - self.states_unused
+            states = np.zeros(max(2 * (used + size), 1024), dtype=np.uint8)
+
+            table_indexes, table_entries = self._expand_ranges(sizes)
+            states[:used] = self.states[old_starts[table_indexes] + table_entries]
+            self.table_starts[computed] = np.cumsum(sizes) - sizes
+            self.states, self.states_used, self.states_unused = states, used, 0
+
+        start = self.states_used
+        self.states_used += size
+        return start
+
+    def _pair_states(self, boxes_a, boxes_b):
+        """
+        Visibility states of piece pairs
+        :param boxes_a: Array of shape (n, 4) with piece boxes (min x, min y, max x, max y) in cells
+        :param boxes_b: Array of shape (n, 4) with the other pieces, disjoint from the first ones
+        :return: Array of shape (n,) with the state of every pair
+        """
+        states = np.full(boxes_a.shape[0], PARTIALLY_VISIBLE, dtype=np.uint8)
+
+        # Check along the axis with the larger gap between both pieces. The piece with the smaller coordinates on that
+        # axis is the near piece. Disjoint pieces are separated on at least one axis.
+        gap_x = np.maximum(boxes_b[:, 0] - boxes_a[:, 2], boxes_a[:, 0] - boxes_b[:, 2]) - 1
+        gap_y = np.maximum(boxes_b[:, 1] - boxes_a[:, 3], boxes_a[:, 1] - boxes_b[:, 3]) - 1
+        along_x = gap_x >= gap_y
+
+        for axis, gap, checked in ((0, gap_x, along_x), (1, gap_y, ~along_x)):
+            # Batches of pairs with similar lengths, so little work is spent on padding columns
+            pairs = np.flatnonzero(checked)
+            length = np.abs(boxes_a[pairs, axis] - boxes_b[pairs, axis])
+            pairs = pairs[np.argsort(length, kind="stable")]
+            walls, cross_walls = ((self.column_walls, self.row_walls) if axis == 0 else
+                                  (self.row_walls, self.column_walls))
+            # Boxes as (min along, min across, max along, max across)
+            order = [0, 1, 2, 3] if axis == 0 else [1, 0, 3, 2]
+
+            for batch_start in range(0, pairs.size, PotentiallyVisibleSet.batch_size):
+                batch = pairs[batch_start:batch_start + PotentiallyVisibleSet.batch_size]
+                box_a, box_b = boxes_a[batch][:, order], boxes_b[batch][:, order]
+                a_is_near = box_a[:, 2] < box_b[:, 0]
+                near = np.where(a_is_near[:, None], box_a, box_b)
+                far = np.where(a_is_near[:, None], box_b, box_a)
+
+                clear = self._hull_clear(near, far, walls)
+                states[batch[clear]] = VISIBLE
+
+                # A clear segment between sample points of both pieces rules out occlusion. Most partially visible
+                # pairs are found this way, only the others get the more expensive occlusion proof.
+                sample_starts, sample_ends = (
+                    boxes[batch, None, :2] + fractions * (boxes[batch, None, 2:] + 1 - boxes[batch, None, :2])
+                    for boxes, fractions in zip((boxes_a, boxes_b), PotentiallyVisibleSet.sample_fractions))
+                sampled_clear = line_of_sight(self.world, sample_starts.reshape(-1, 2),
+                                              sample_ends.reshape(-1, 2)).reshape(batch.size, -1).any(axis=1)
+                occlusion_checked = ~clear & ~sampled_clear & (gap[batch] > 0)
+                blocked = self._bundles_blocked(near[occlusion_checked], far[occlusion_checked], walls, cross_walls)
+                states[batch[occlusion_checked][blocked]] = HIDDEN
+
+        return states
+
+    def _hull_clear(self, near, far, walls):
+        """
+        Check whether the convex hull of near and far boxes that are separated along an axis covers no wall
+        :param near: Array of shape (n, 4) with the near boxes (min along, min across, max along, max across)
+        :param far: Array of shape (n, 4) with the far boxes
+        :param walls: wall prefix sums, walls[along, across] is the wall amount before across in a line along the axis
+        :return: Boolean array of shape (n,), True where all segments between both boxes are clear
+        """
+        epsilon = PotentiallyVisibleSet.epsilon
+        if not near.shape[0]:
+            return np.zeros(0, dtype=bool)
+
+        # Lowest and highest across coordinate of the hull on every cell border along the axis. The hull is made of
+        # both boxes and the lines between their corners.
+        span_start, span_end = near[:, 0], far[:, 2] + 1
+        border = span_start[:, None] + np.arange(int((span_end - span_start).max()) + 1)
+        in_span = border <= span_end[:, None]
+        border = np.minimum(border, span_end[:, None]).astype(np.float64)
+
+        in_near = (border <= near[:, 2:3] + 1)
+        in_far = (border >= far[:, 0:1])
+        low = np.where(in_near, near[:, 1:2], np.inf)
+        low = np.where(in_far, np.minimum(low, far[:, 1:2]), low)
+        high = np.where(in_near, near[:, 3:4] + 1, -np.inf)
+        high = np.where(in_far, np.maximum(high, far[:, 3:4] + 1), high)
+
+        for near_along in (near[:, 0:1], near[:, 2:3] + 1):
+            for far_along in (far[:, 0:1], far[:, 2:3] + 1):
+                on_line = (border >= near_along) & (border <= far_along) & (far_along > near_along)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    weight = (border - near_along) / (far_along - near_along)
+                    low = np.where(on_line, np.minimum(low, near[:, 1:2] + weight * (far[:, 1:2] - near[:, 1:2])),
+                                   low)
+                    high = np.where(on_line, np.maximum(high, near[:, 3:4] + 1 + weight * (far[:, 3:4] - near[:, 3:4])),
+                                    high)
+
+        # Cells the hull covers in every column, the extremes of a column lie on its borders. The DDA only visits rows
+        # between the rows of both end points.
+        across_min = np.minimum(near[:, 1], far[:, 1])[:, None]
+        across_end = np.maximum(near[:, 3], far[:, 3])[:, None] + 1
+        low = np.floor(np.minimum(low[:, :-1], low[:, 1:]) - epsilon).clip(across_min, across_end).astype(np.int64)
+        high = (np.floor(np.maximum(high[:, :-1], high[:, 1:]) + epsilon) + 1).clip(across_min, across_end).astype(
+            np.int64)
+        column = np.minimum(border[:, :-1], span_end[:, None] - 1).astype(np.int64)
+        wall_amount = walls[column, high].astype(np.int64) - walls[column, low]
+        return ~((wall_amount > 0) & in_span[:, 1:]).any(axis=1)
+
+    def _bundles_blocked(self, near, far, walls, cross_walls):
+        """
+        Check the segment bundles between near and far boxes that are separated along an axis. A line of the bundle is
+        described by its across coordinates start (at the near end of the gap) and end (at the far end of the gap).
+        :param near: Array of shape (n, 4) with the near boxes (min along, min across, max along, max across)
+        :param far: Array of shape (n, 4) with the far boxes
+        :param walls: wall prefix sums, walls[along, across] is the wall amount before across in a line along the axis
+        :param cross_walls: wall prefix sums across the axis, cross_walls[across, along]
+        :return: Boolean array of shape (n,), True where all segments are blocked
+        """
+        epsilon = PotentiallyVisibleSet.epsilon
+        pair_amount = near.shape[0]
+        if not pair_amount:
+            return np.zeros(0, dtype=bool)
+
+        gap_start = near[:, 2] + 1
+        gap_end = far[:, 0]
+        gap_length = gap_end - gap_start
+
+        # The DDA only visits rows between the rows of both end points, so cells outside of both boxes are never passed
+        across_min = np.minimum(near[:, 1], far[:, 1])
+        across_end = np.maximum(near[:, 3], far[:, 3]) + 1
+
+        # Range of the across coordinates of all lines at both gap ends, from all corner combinations of both boxes.
+        # Every line through both boxes is a convex combination of its end points, monotonic in all corner coordinates.
+        near_along = np.stack([near[:, 0], gap_start], axis=1)[:, :, None, None, None]
+        far_along = np.stack([gap_end, far[:, 2] + 1], axis=1)[:, None, :, None, None]
+        near_across = np.stack([near[:, 1], near[:, 3] + 1], axis=1)[:, None, None, :, None]
+        far_across = np.stack([far[:, 1], far[:, 3] + 1], axis=1)[:, None, None, None, :]
+        bundle = []
+        for along in (gap_start, gap_end):
+            weight = (along[:, None, None, None, None] - near_along) / (far_along - near_along)
+            across = (near_across + weight * (far_across - near_across)).reshape(pair_amount, -1)
+            bundle += [across.min(axis=1), across.max(axis=1)]
+
+        # Work list of bundles (pair, start min, start max, end min, end max, split depth)
+        pair = np.arange(pair_amount)
+        start_min, start_max, end_min, end_max = bundle
+        depth = np.zeros(pair_amount, dtype=np.int64)
+        visible = np.zeros(pair_amount, dtype=bool)
+
+        span = np.arange(int((far[:, 2] + 1 - near[:, 0]).max()) + 1)
+        row = np.arange(int((across_end - across_min).max()))
+        flat_walls, flat_cross_walls = walls.reshape(-1), cross_walls.reshape(-1)
+
+        def real_lines(ascending, monotonic):
+            # Corners of the part of every bundle with lines through both boxes, as start and end arrays (bundles,
+            # candidates) with a mask of the candidates that are corners. Lines that head the same way across the axis
+            # pass a box where they are beyond its near side at its along end and before its far side at its along
+            # start. Constraints are weight_start * start + weight_end * end <= limit.
+            length = gap_length[pair]
+            near_weight = (near[pair, 0] - gap_start[pair]) / length
+            far_weight = (far[pair, 2] + 1 - gap_start[pair]) / length
+            sign = np.where(ascending, 1.0, -1.0)
+            zero, one = np.zeros_like(sign), np.ones_like(sign)
+            constraints = np.stack([
+                (-sign, zero, np.where(ascending, -near[pair, 1], near[pair, 3] + 1) + epsilon),
+                (sign * (1 - near_weight), sign * near_weight,
+                 np.where(ascending, near[pair, 3] + 1, -near[pair, 1]) + epsilon),
+                (zero, sign, np.where(ascending, far[pair, 3] + 1, -far[pair, 1]) + epsilon),
+                (-sign * (1 - far_weight), -sign * far_weight,
+                 np.where(ascending, -far[pair, 1], far[pair, 3] + 1) + epsilon),
+                (-one, zero, -start_min), (one, zero, start_max), (zero, -one, -end_min), (zero, one, end_max)])
+            # Bundles with lines heading both ways are only bounded by their ranges
+            constraints[:4] = np.where(monotonic, constraints[:4], np.array([0, 0, 1])[:, None])
+            weight_start, weight_end, limit = (values[:, :, None] for values in constraints.transpose(1, 2, 0))
+
+            # Corners are the intersections of two constraint lines that fulfill all constraints
+            first, second = np.triu_indices(constraints.shape[0], 1)
+            start_a, end_a, limit_a = constraints[first].transpose(1, 2, 0)
+            start_b, end_b, limit_b = constraints[second].transpose(1, 2, 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                determinant = start_a * end_b - end_a * start_b
+                starts = (limit_a * end_b - end_a * limit_b) / determinant
+                ends = (start_a * limit_b - limit_a * start_b) / determinant
+            corner = np.isfinite(starts) & np.isfinite(ends)
+            starts, ends = np.where(corner, starts, 0), np.where(corner, ends, 0)
+            corner &= (weight_start * starts[:, None] + weight_end * ends[:, None] <=
+                       limit + epsilon * (1 + np.abs(limit))).all(axis=1)
+
+            # Move the corners to the front, only few of the candidates are corners
+            order = np.argsort(~corner, axis=1, kind="stable")[:, :max(int(corner.sum(axis=1).max()), 1)]
+            return (np.take_along_axis(starts, order, axis=1), np.take_along_axis(ends, order, axis=1),
+                    np.take_along_axis(corner, order, axis=1))
+
+        def box_missed(box, box_start, box_end):
+            # Bundles with all lines on the same side of a box at both of its along ends miss it
+            below, above = np.ones(pair.size, dtype=bool), np.ones(pair.size, dtype=bool)
+            for along in (box_start, box_end):
+                weight = (along - gap_start[pair]) / gap_length[pair]
+                across = [start + weight * (end - start)
+                          for start in (start_min, start_max) for end in (end_min, end_max)]
+                below &= np.maximum.reduce(across) < box[pair, 1] - epsilon
+                above &= np.minimum.reduce(across) > box[pair, 3] + 1 + epsilon
+            return below | above
+
+        def extremes(values, corner):
+            # Lowest and highest value over the corners, along the last but one axis
+            return (np.where(corner, values, np.inf).min(axis=-2), np.where(corner, values, -np.inf).max(axis=-2))
+
+        def lines_blocked(flat, line_index, low, high, first, end, cell_start, cell_end, valid):
+            # Lines that cross a center line only in non empty cells or all pass the same non empty cell. Only cells
+            # from cell_start up to cell_end (exclusive) lie on the segments.
+            low, high = np.floor(low - epsilon).astype(np.int64), np.floor(high + epsilon).astype(np.int64) + 1
+            low = np.minimum(low, high)
+            crossed = valid & (low >= cell_start) & (high <= cell_end)
+            low, high = np.where(crossed, low, 0), np.where(crossed, high, 0)
+            crossed &= np.take(flat, line_index + high).astype(np.int64) - np.take(flat, line_index + low) == high - low
+
+            first = np.maximum(np.floor(first + epsilon), cell_start).astype(np.int64)
+            end = np.minimum(np.ceil(end - epsilon), cell_end).astype(np.int64)
+            passed = valid & (end > first)
+            first, end = np.where(passed, first, 0), np.where(passed, end, 0)
+            passed &= np.take(flat, line_index + end).astype(np.int64) - np.take(flat, line_index + first) > 0
+            return (crossed | passed).any(axis=1)
+
+        while pair.size:
+            length = gap_length[pair][:, None]
+            low_across, high_across = across_min[pair][:, None], across_end[pair][:, None]
+            near_box, far_box = near[pair][:, :, None], far[pair][:, :, None]
+            ascending = (end_min - start_max > epsilon)
+            monotonic = ascending | (end_max - start_min < -epsilon)
+
+            # Bundles without a line through both boxes hold no segment
+            starts, ends, corner = real_lines(ascending, monotonic)
+            blocked = (~corner.any(axis=1) | box_missed(near, near[pair, 0], gap_start[pair]) |
+                       box_missed(far, gap_end[pair], far[pair, 2] + 1))
+            corner[blocked, 0] = True
+            ascending, monotonic = ascending[:, None], monotonic[:, None]
+
+            # Lowest and highest line on every column border from the near box to the far box
+            borders = near[pair, 0][:, None] + span
+            across = (starts[:, :, None] + ((borders - gap_start[pair][:, None]) / length)[:, None, :] *
+                      (ends - starts)[:, :, None])
+            low, high = extremes(across, corner[:, :, None])
+
+            # Cells of a column that lie on all segments of a line: the gap cells within the rows of both boxes and, in
+            # the columns of a box, the cells between it and the other box across the axis. Lines head the same way
+            # across the axis all along, so they pass these cells after leaving the near box and before entering the
+            # far one.
+            columns = borders[:, :-1]
+            in_gap = (columns >= gap_start[pair][:, None]) & (columns < gap_end[pair][:, None])
+            in_near = columns < gap_start[pair][:, None]
+            cell_start = np.where(in_gap | (in_near ^ ascending), low_across,
+                                  np.where(in_near, near_box[:, 3], far_box[:, 3]) + 1)
+            cell_end = np.where(in_gap | (in_near == ascending), high_across,
+                                np.where(in_near, near_box[:, 1], far_box[:, 1]))
+            valid = (columns <= far[pair, 2][:, None]) & (in_gap | monotonic)
+            line_index = np.minimum(columns, walls.shape[0] - 1) * walls.shape[1]
+            # Gap cells outside of the rows of both boxes hold no real segment, a center line may cross them
+            center_low = np.where(in_gap, np.maximum((low[:, :-1] + low[:, 1:]) / 2, low_across),
+                                  (low[:, :-1] + low[:, 1:]) / 2)
+            center_high = np.where(in_gap, np.minimum((high[:, :-1] + high[:, 1:]) / 2, high_across - 2 * epsilon),
+                                   (high[:, :-1] + high[:, 1:]) / 2)
+            blocked |= lines_blocked(flat_walls, line_index, center_low, center_high,
+                                     np.where(ascending, high[:, :-1], high[:, 1:]),
+                                     np.where(ascending, low[:, 1:], low[:, :-1]), cell_start, cell_end, valid)
+
+            # Same for the rows within the rows of both boxes, from the along positions of the corner lines on every
+            # row border and center line. Gap cells lie on all segments, rows between both boxes in all their cells.
+            rows = low_across + row
+            with np.errstate(divide="ignore", invalid="ignore"):
+                along = [gap_start[pair][:, None, None] + length[:, :, None] *
+                         (across[:, None, :] - starts[:, :, None]) / (ends - starts)[:, :, None]
+                         for across in (low_across + np.arange(row.size + 1), rows + 0.5)]
+            along = [np.nan_to_num(values, nan=0, posinf=0, neginf=0).clip(near_box[:, 0:1] - 1, far_box[:, 2:3] + 2)
+                     for values in along]
+            (border_min, border_max), (center_min, center_max) = (extremes(values, corner[:, :, None])
+                                                                  for values in along)
+            between = np.where(ascending, (rows > near_box[:, 3]) & (rows < far_box[:, 1]),
+                               (rows < near_box[:, 1]) & (rows > far_box[:, 3]))
+            cell_start = np.where(between, near_box[:, 0], gap_start[pair][:, None])
+            cell_end = np.where(between, far_box[:, 2] + 1, gap_end[pair][:, None])
+            line_index = np.minimum(rows, cross_walls.shape[0] - 1) * cross_walls.shape[1]
+            blocked |= lines_blocked(flat_cross_walls, line_index, center_min, center_max,
+                                     np.where(ascending, border_max[:, :-1], border_max[:, 1:]),
+                                     np.where(ascending, border_min[:, 1:], border_min[:, :-1]), cell_start, cell_end,
+                                     (rows < high_across) & monotonic)
+
+            # A line through both boxes that enters the gap from the near box, leaves it into the far box and passes no
+            # wall in the cells of the gap is a clear segment, the pair is partially visible
+            center_start = np.where(corner, starts, 0).sum(axis=1) / corner.sum(axis=1)
+            center_end = np.where(corner, ends, 0).sum(axis=1) / corner.sum(axis=1)
+            weight = np.arange(int(gap_length.max()) + 1) / length
+            center = center_start[:, None] + weight * (center_end - center_start)[:, None]
+            center_low = np.floor(np.minimum(center[:, :-1], center[:, 1:]) - epsilon).clip(low_across, high_across)
+            center_high = (np.floor(np.maximum(center[:, :-1], center[:, 1:]) + epsilon) + 1).clip(low_across,
+                                                                                                 high_across)
+            column = np.arange(weight.shape[1] - 1)
+            line_index = (gap_start[pair][:, None] + np.minimum(column, length - 1)) * walls.shape[1]
+            wall_amount = (np.take(flat_walls, line_index + center_high.astype(np.int64)).astype(np.int64) -
+                           np.take(flat_walls, line_index + center_low.astype(np.int64)))
+            clear = (~blocked & ~((wall_amount > 0) & (column < length)).any(axis=1) &
+                     (center_start >= near[pair, 1]) & (center_start <= near[pair, 3] + 1) &
+                     (center_end >= far[pair, 1]) & (center_end <= far[pair, 3] + 1))
+            visible[pair[clear | (~blocked & (depth >= PotentiallyVisibleSet.max_split_depth))]] = True
+
+            # Split the remaining bundles on the wider end. Pairs with too many unresolved bundles are given up.
+            unresolved = np.bincount(pair[~blocked], minlength=pair_amount)
+            visible |= unresolved > PotentiallyVisibleSet.max_bundles // 2
+            remaining = ~blocked & ~visible[pair]
+            pair, depth = pair[remaining], depth[remaining] + 1
+            start_min, start_max = start_min[remaining], start_max[remaining]
+            end_min, end_max = end_min[remaining], end_max[remaining]
+            split_start = (start_max - start_min) >= (end_max - end_min)
+            start_center, end_center = (start_min + start_max) / 2, (end_min + end_max) / 2
+
+            pair, depth = np.concatenate([pair, pair]), np.concatenate([depth, depth])
+            start_min, start_max, end_min, end_max = (
+                np.concatenate([start_min, np.where(split_start, start_center, start_min)]),
+                np.concatenate([np.where(split_start, start_center, start_max), start_max]),
+                np.concatenate([end_min, np.where(split_start, end_min, end_center)]),
+                np.concatenate([np.where(split_start, end_max, end_center), end_max]))
+
+        return ~visible
+
+    def _on_cell_changed(self, pos_x: int, pos_y: int, value: int):
+        self.dirty_columns[pos_x] = True
+        self.dirty_rows[pos_y] = True
+        self.dirty_regions[pos_y // self.region_size, pos_x // self.region_size] = True
+
+    def _on_region_changed(self, start_x: int, start_y: int, length_x: int, length_y: int):
+        end_x, end_y = start_x + length_x, start_y + length_y
+        self.dirty_columns[start_x:end_x] = True
+        self.dirty_rows[start_y:end_y] = True
+        self.dirty_regions[start_y // self.region_size:(end_y - 1) // self.region_size + 1,
+                           start_x // self.region_size:(end_x - 1) // self.region_size + 1] = True
+
+    def visibility_states(self, starts, ends):
+        """
+        Batched table lookup of the visibility state of position pairs
+        :param starts: Array of shape (n, 2) with the start positions (x, y)
+        :param ends: Array of shape (n, 2) with the end positions (x, y)
+        :return: Array of shape (n,) with HIDDEN, VISIBLE or PARTIALLY_VISIBLE, which is also used for pairs the table
+        can not answer for
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        self.update(0)
+
+        # Only positions in empty cells of the world are covered by the table. End points on a cell border are
+        # traced, the DDA may stop in the cell before or after them.
+        cells = []
+        for positions in (starts, ends):
+            with np.errstate(invalid="ignore"):
+                cell_x, cell_y = np.floor(positions[:, 0]), np.floor(positions[:, 1])
+            inside = (cell_x >= 0) & (cell_x < self.world.size_x) & (cell_y >= 0) & (cell_y < self.world.size_y)
+            cell_x = np.where(inside, cell_x, 0).astype(np.int64)
+            cell_y = np.where(inside, cell_y, 0).astype(np.int64)
+            cells.append((cell_x, cell_y, inside, self.cell_pieces.reshape(-1)[cell_y * self.world.size_x + cell_x]))
+
+        epsilon = PotentiallyVisibleSet.epsilon
+        start_cell_x, start_cell_y, start_inside, start_pieces = cells[0]
+        end_cell_x, end_cell_y, end_inside, end_pieces = cells[1]
+        with np.errstate(invalid="ignore"):
+            border_distance = np.abs(ends - np.round(ends))
+            off_border = (border_distance[:, 0] > epsilon) & (border_distance[:, 1] > epsilon)
+        in_table = start_inside & end_inside & (start_pieces != 255) & (end_pieces != 255) & off_border
+
+        # The DDA enters the cell of an end point off the cell borders before its end, a non empty end cell that is not
+        # the start cell is always hit
+        states = np.full(starts.shape[0], PARTIALLY_VISIBLE, dtype=np.uint8)
+        states[start_inside & end_inside & (end_pieces == 255) & off_border &
+               ((start_cell_x != end_cell_x) | (start_cell_y != end_cell_y))] = HIDDEN
+
+        start_x, start_y = start_cell_x // self.region_size, start_cell_y // self.region_size
+        end_x, end_y = end_cell_x // self.region_size, end_cell_y // self.region_size
+        offset_x, offset_y = end_x - start_x, end_y - start_y
+        in_table &= (np.abs(offset_x) <= self.reach) & (np.abs(offset_y) <= self.reach)
+        offset_index = self.offset_index[np.clip(offset_y + self.reach, 0, 2 * self.reach),
+                                         np.clip(offset_x + self.reach, 0, 2 * self.reach)]
+        in_table &= offset_index >= 0
+
+        # Add missing tables and check pairs within the budget, pairs that are not checked yet are traced
+        queried = np.flatnonzero(in_table)
+        regions = start_y[queried] * self.regions_x + start_x[queried]
+        self.requested.reshape(-1)[regions[self.table_starts.reshape(-1)[regions] < 0]] = True
+        self.update(PotentiallyVisibleSet.pairs_per_query)
+        table_starts = self.table_starts.reshape(-1)[regions]
+        added = table_starts >= 0
+        queried, regions, table_starts = queried[added], regions[added], table_starts[added]
+
+        # Row of the start piece and column of the end piece, from the column amount and the first column of the region
+        # offset in neighbor_starts
+        neighbor_starts = self.neighbor_starts.reshape(-1)
+        row_length = self.offset_x.size + 1
+        entries = (table_starts + start_pieces[queried] * neighbor_starts[regions * row_length + row_length - 1] +
+                   neighbor_starts[regions * row_length + offset_index[queried]] + end_pieces[queried])
+        states[queried] = self.states[entries]
+        return states
+
+    def potentially_visible(self, starts, ends):
+        """
+        Batched table lookup whether two positions can see each other. Positions the table can not answer for are
+        potentially visible.
+        :param starts: Array of shape (n, 2) with the start positions (x, y)
+        :param ends: Array of shape (n, 2) with the end positions (x, y)
+        :return: Boolean array of shape (n,), False only where the positions are proven not to see each other
+        """
+        return self.visibility_states(starts, ends) != HIDDEN
+
+    def can_see(self, starts, ends):
+        """
+        Batched exact line of sight checks, same result as line_of_sight. Only pairs the table does not answer are
+        traced.
+        :param starts: Array of shape (n, 2) with the start positions (x, y)
+        :param ends: Array of shape (n, 2) with the end positions (x, y)
+        :return: Boolean array of shape (n,)
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        states = self.visibility_states(starts, ends)
+
+        visible = states == VISIBLE
+        traced = np.flatnonzero(states == PARTIALLY_VISIBLE)
+        visible[traced] = line_of_sight(self.world, starts[traced], ends[traced])
+        return visible
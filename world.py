@@ -1,14 +1,40 @@
+import logging
 import math
+import numpy as np
+from grid_traversal import cast_grid_rays
+from trig_tables import get_angle_table
+
+
+logger = logging.getLogger(__name__)
 
 
 class GridWorld:
-    def __init__(self, size_x: int, size_y: int, cell_size: int = 100):
+    def __init__(self, size_x: int, size_y: int, cell_size: int = 100, buffer=None, floor_buffer=None):
         self.size_x = size_x
         self.size_y = size_y
         self.cell_size = cell_size
 
-        # Initialize grid
-        self.grid = [[0 for _ in range(self.size_x)] for _ in range(self.size_y)]
+        # Initialize grid. Cells are stored packed as one byte each, row after row (row stride = size_x). The grid
+        # attribute is a 2D numpy view (rows, columns) on the same memory for vectorized access. An existing buffer
+        # (shared memory, memory mapped file) can be used as storage instead of a new bytearray.
+        if buffer is None:
+            self.cells = bytearray(self.size_x * self.size_y)
+        else:
+            self.cells = memoryview(buffer).cast("B")[:self.size_x * self.size_y]
+        self.grid = np.frombuffer(self.cells, dtype=np.uint8).reshape(self.size_y, self.size_x)
+
+        # Floor material of every cell (rows, columns). Only visible in empty cells, selects the floor and ceiling
+        # textures of the first person view. Stored in the same layout as the cells, optionally in an external buffer.
+        if floor_buffer is None:
+            self.floor_grid = np.zeros((self.size_y, self.size_x), dtype=np.uint8)
+        else:
+            self.floor_grid = np.frombuffer(memoryview(floor_buffer).cast("B")[:self.size_x * self.size_y],
+                                            dtype=np.uint8).reshape(self.size_y, self.size_x)
+
+        # Functions called with (pos_x, pos_y, value) after a cell value was set and functions called with
+        # (start_x, start_y, length_x, length_y) after a block of cells was set at once
+        self.on_change_functions = []
+        self.on_region_change_functions = []
 
     def __str__(self):
         return_str = ""
@@ -18,41 +44,170 @@ class GridWorld:
         return return_str
 
     def get_value(self, pos_x: int, pos_y: int):
-        return self.grid[pos_y][pos_x]
+        # Index the 2D view, an x past the row end of the packed cells must fail instead of reading the next row
+        return self.grid.item(pos_y, pos_x)
 
     def set_value(self, pos_x: int, pos_y: int, value: int):
-        self.grid[pos_y][pos_x] = value
-        print(f"[GRID] Cell x={pos_x}, y={pos_y} set to {value}.")
+        self.grid[pos_y, pos_x] = value
+        logger.debug("Cell x=%s, y=%s set to %s.", pos_x, pos_y, value)
+        for on_change_function in self.on_change_functions:
+            on_change_function(pos_x, pos_y, value)
+
+    def set_value_block(self, start_x: int, start_y: int, length_x: int, length_y: int, value: int):
+        """
+        Set all cells of a rectangle to a value in one write
+        """
+        self.grid[start_y:start_y + length_y, start_x:start_x + length_x] = value
+        logger.debug("Block x=%s, y=%s, %sx%s set to %s.", start_x, start_y, length_x, length_y, value)
+        self._region_changed(start_x, start_y, length_x, length_y)
+
+    def set_value_array(self, start_x: int, start_y: int, values):
+        """
+        Copy a 2D array of cell values (rows, columns) into the grid in one write
+        """
+        values = np.asarray(values, dtype=np.uint8)
+        length_y, length_x = values.shape
+        self.grid[start_y:start_y + length_y, start_x:start_x + length_x] = values
+        logger.debug("Array x=%s, y=%s, %sx%s set.", start_x, start_y, length_x, length_y)
+        self._region_changed(start_x, start_y, length_x, length_y)
+
+    def set_value_list(self, edits):
+        """
+        Set many single cells in one write. Every edit is reported to the cell change functions on its own, so scattered
+        edits do not mark the whole area between them as changed.
+        :param edits: list or array of (pos_x, pos_y, value) edits
+        """
+        edits = np.asarray(edits, dtype=np.int64).reshape(-1, 3)
+        if not edits.shape[0]:
+            return
+
+        # Negative indexes would wrap around in numpy instead of failing like set_value
+        pos_x, pos_y, values = edits.T
+        if pos_x.min() < 0 or pos_x.max() >= self.size_x or pos_y.min() < 0 or pos_y.max() >= self.size_y:
+            raise IndexError(f"Cell positions must be within {self.size_x}x{self.size_y}.")
+        if values.min() < 0 or values.max() > 255:
+            raise ValueError("Cell values must be in range(0, 256).")
+
+        self.grid[pos_y, pos_x] = values
+        logger.debug("%s cells set.", edits.shape[0])
+        for pos_x, pos_y, value in edits.tolist():
+            for on_change_function in self.on_change_functions:
+                on_change_function(pos_x, pos_y, value)
+
+    def set_floor_value(self, pos_x: int, pos_y: int, value: int):
+        self.floor_grid[pos_y, pos_x] = value
+
+    def set_floor_block(self, start_x: int, start_y: int, length_x: int, length_y: int, value: int):
+        """
+        Set the floor material of all cells of a rectangle
+        """
+        self.floor_grid[start_y:start_y + length_y, start_x:start_x + length_x] = value
+
+    def _region_changed(self, start_x, start_y, length_x, length_y):
+        # Clip region to the grid before handing it to the region change functions
+        end_x, end_y = min(start_x + length_x, self.size_x), min(start_y + length_y, self.size_y)
+        start_x, start_y = max(start_x, 0), max(start_y, 0)
+        if end_x <= start_x or end_y <= start_y:
+            return
+
+        for on_region_change_function in self.on_region_change_functions:
+            on_region_change_function(int(start_x), int(start_y), int(end_x - start_x), int(end_y - start_y))
 
     def get_grid(self):
         return self.grid
 
+    def use_buffer(self, buffer, copy_values: bool = True, floor_buffer=None):
+        """
+        Move the cell storage into an external buffer, e.g. shared memory. The buffer must hold one byte per cell in
+        the same row after row layout.
+        :param buffer: buffer object of at least size_x * size_y bytes
+        :param copy_values: copy the current cell values (and floor materials) into the buffers
+        :param floor_buffer: optional buffer of the same size to move the floor materials into
+        """
+        cells = memoryview(buffer).cast("B")[:self.size_x * self.size_y]
+        if copy_values:
+            cells[:] = self.cells
+        self.cells = cells
+        self.grid = np.frombuffer(self.cells, dtype=np.uint8).reshape(self.size_y, self.size_x)
+
+        if floor_buffer is not None:
+            floor_grid = np.frombuffer(memoryview(floor_buffer).cast("B")[:self.size_x * self.size_y],
+                                       dtype=np.uint8).reshape(self.size_y, self.size_x)
+            if copy_values:
+                floor_grid[:] = self.floor_grid
+            self.floor_grid = floor_grid
+
     def toggle_value(self, pos_x: int, pos_y: int):
-        if self.grid[pos_y][pos_x] == 0:
+        if self.get_value(pos_x, pos_y) == 0:
             self.set_value(pos_x, pos_y, 1)
         else:
             self.set_value(pos_x, pos_y, 0)
 
     def calc_distance(self, pos_x, pos_y, angle_degrees):
-        tan_angle = math.tan(math.radians(angle_degrees))  # Convert angle to radians
-
-        # Get horizontal intersection
-        yn = math.ceil(pos_y) - pos_y  # y distance nearest y cell border
-        xn = yn / tan_angle  # x distance nearest y cell border
-        distance_n = (yn*2 + xn*2)**.5
-
-        horizontal_intersection_x = pos_x + xn
-        horizontal_intersection_y = int(pos_y + yn)   # Int bc always on border
-
-        print(math.floor(horizontal_intersection_x), horizontal_intersection_y)
-        print(distance_n)
-        # Check collision
-        if self.get_value(math.floor(horizontal_intersection_x), horizontal_intersection_y):
-
-            print("col")
+        """
+        Distance from a position to the first non empty cell in a direction. Steps cell by cell (Amanatides & Woo DDA),
+        always crossing the closer of the next vertical and horizontal cell border. Positions are in cell units.
+        :param pos_x: x start position
+        :param pos_y: y start position
+        :param angle_degrees: ray direction in degrees
+        :return: Dictionary with collision coordinates, collided cell, distance, side of the cell that was hit
+        (0: vertical border, 1: horizontal border) and wall offset (position of the hit along the wall face, 0 to 1).
+        All values are None if the ray leaves the world without a hit.
+        """
+        direction_x, direction_y = get_angle_table().direction(angle_degrees)
+
+        # Cell the ray starts in and step direction on both axes
+        cell_x, cell_y = math.floor(pos_x), math.floor(pos_y)
+        step_x = 1 if direction_x > 0 else -1
+        step_y = 1 if direction_y > 0 else -1
+
+        # Ray length to the next vertical/horizontal border, computed from the border position like in
+        # grid_traversal.cast_grid_rays
+        t_max_x = (cell_x + (step_x > 0) - pos_x) / direction_x if direction_x != 0 else math.inf
+        t_max_y = (cell_y + (step_y > 0) - pos_y) / direction_y if direction_y != 0 else math.inf
+
+        # Step over the closer border until a collision or the end of the world
+        while True:
+            if t_max_x < t_max_y:
+                distance, side = t_max_x, 0
+                cell_x += step_x
+                t_max_x = (cell_x + (step_x > 0) - pos_x) / direction_x
+            else:
+                distance, side = t_max_y, 1
+                cell_y += step_y
+                t_max_y = (cell_y + (step_y > 0) - pos_y) / direction_y
+
+            if not (0 <= cell_x < self.size_x and 0 <= cell_y < self.size_y):
+                return {"collision_coord_x": None, "collision_coord_y": None,
+                        "collided_cell_x": None, "collided_cell_y": None,
+                        "distance": None, "side": None, "wall_offset": None}
+
+            # Check collision
+            if self.get_value(cell_x, cell_y):
+                collision_coord_x = pos_x + distance * direction_x
+                collision_coord_y = pos_y + distance * direction_y
+                return {"collision_coord_x": collision_coord_x, "collision_coord_y": collision_coord_y,
+                        "collided_cell_x": cell_x, "collided_cell_y": cell_y,
+                        "distance": distance, "side": side,
+                        "wall_offset": (collision_coord_y if side == 0 else collision_coord_x) % 1}
+
+    def cast_rays(self, origins, angles, directions=None, max_distances=None):
+        """
+        Cast a batch of rays through the grid at once with the same DDA stepping as calc_distance. Positions are in
+        cell units.
+        :param origins: Array of shape (n, 2) with the start positions (x, y) of every ray
+        :param angles: Array of shape (n,) with the angle of every ray in degrees
+        :param directions: Optional precomputed (x, y) direction arrays of the rays, skips all trigonometry
+        :param max_distances: Optional array of shape (n,) with the length of every ray. Rays without a hit up to
+        their length stop early and count as leaving the world.
+        :return: Ray cast result dictionary of grid_traversal.cast_grid_rays
+        """
+        if directions is None:
+            direction_x, direction_y = get_angle_table().directions(np.asarray(angles, dtype=np.float64).reshape(-1))
+        else:
+            direction_x, direction_y = (np.asarray(direction, dtype=np.float64).reshape(-1) for direction in directions)
 
-        return {"horizontal_intersection_x": horizontal_intersection_x,
-                "horizontal_intersection_y": horizontal_intersection_y}
+        return cast_grid_rays(self.grid, origins, direction_x, direction_y, max_distances=max_distances)
 
 
 if __name__ == '__main__':
@@ -62,4 +217,4 @@ if __name__ == '__main__':
     gw.set_value(2, 2, 1)
     gw.set_value(3, 2, 1)
     print(gw)
-    gw.calc_distance(1.5, 1.5, 45)
+    print(gw.calc_distance(1.5, 1.5, 45))
@@ -0,0 +1,110 @@
+import struct
+import numpy as np
+from world import GridWorld
+
+
+# Binary world file format
+#
+# Header (64 bytes, little endian):
+#     magic        8 bytes   b"RAYWORLD"
+#     version      uint32
+#     size_x       uint32    cells per row
+#     size_y       uint32    rows
+#     cell_size    uint32
+#     chunk_rows   uint32    rows per chunk
+#     reserved     up to 64 bytes
+#
+# Body: two layers, the cell values followed by the floor materials (since version 2). Every layer is made of fixed
+# size chunks of chunk_rows * size_x bytes, one byte per cell. Chunks hold complete rows, so a layer is the same row
+# after row layout as GridWorld.cells and GridWorld.floor_grid and can be memory mapped as their storage directly. The
+# last chunk of a layer is padded with zeros to the full chunk size. Version 1 files only have the cell layer.
+
+MAGIC = b"RAYWORLD"
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER_FORMAT = "<8sIIIII"
+HEADER_SIZE = 64
+
+
+def read_header(path: str):
+    """
+    Read the header of a world file
+    :return: Dictionary with version, size_x, size_y, cell_size, chunk_rows and layer_size (bytes per layer)
+    """
+    with open(path, "rb") as file:
+        magic, version, size_x, size_y, cell_size, chunk_rows = struct.unpack(
+            HEADER_FORMAT, file.read(struct.calcsize(HEADER_FORMAT)))
+
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a world file.")
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"World file version {version} of {path} is not supported.")
+
+    return {"version": version, "size_x": size_x, "size_y": size_y, "cell_size": cell_size, "chunk_rows": chunk_rows,
+            "layer_size": get_layer_size(size_x, size_y, chunk_rows)}
+
+
+def get_layer_size(size_x: int, size_y: int, chunk_rows: int):
+    """
+    Bytes of one layer (cells or floor) including the padding of the last chunk
+    """
+    return -(-size_y // chunk_rows) * chunk_rows * size_x
+
+
+def create_world_file(path: str, size_x: int, size_y: int, cell_size: int = 100, chunk_rows: int = 64):
+    """
+    Create an empty world file. The body is only allocated on disk when it is written, so very large worlds can be
+    created and then filled chunk by chunk through load_world(path, mode="r+").
+    :param chunk_rows: rows per chunk
+    :return: path of the created file
+    """
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, size_x, size_y, cell_size, chunk_rows)
+
+    with open(path, "wb") as file:
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        file.truncate(HEADER_SIZE + 2 * get_layer_size(size_x, size_y, chunk_rows))
+
+    return path
+
+
+def save_world(world: GridWorld, path: str, chunk_rows: int = 64):
+    """
+    Write a grid world with its floor materials to a world file, one chunk at a time
+    :param world: GridWorld to save
+    :param path: output file path
+    :param chunk_rows: rows per chunk
+    """
+    create_world_file(path, world.size_x, world.size_y, world.cell_size, chunk_rows)
+
+    with open(path, "r+b") as file:
+        file.seek(HEADER_SIZE)
+        for chunk_start in range(0, world.size_y, chunk_rows):
+            file.write(world.grid[chunk_start:chunk_start + chunk_rows].tobytes())
+
+        file.seek(HEADER_SIZE + get_layer_size(world.size_x, world.size_y, chunk_rows))
+        for chunk_start in range(0, world.size_y, chunk_rows):
+            file.write(world.floor_grid[chunk_start:chunk_start + chunk_rows].tobytes())
+
+    print(f"[WORLD] Saved {world.size_x}x{world.size_y} world to {path}.")
+
+
+def load_world(path: str, mode: str = "r"):
+    """
+    Open a world file as a GridWorld. The cells and floor materials are memory mapped, so loading is instant and only
+    the parts of the map that are actually accessed are read from disk. Version 1 files without a floor layer get an
+    empty floor in memory.
+    :param path: world file path
+    :param mode: numpy memmap mode. "r" is read only, "r+" writes changes to the file, "c" keeps changes in memory
+    only.
+    :return: GridWorld using the file as cell and floor storage
+    """
+    header = read_header(path)
+    cell_amount = header["size_x"] * header["size_y"]
+    cells = np.memmap(path, dtype=np.uint8, mode=mode, offset=HEADER_SIZE, shape=(cell_amount,))
+
+    floor = None
+    if header["version"] >= 2:
+        floor = np.memmap(path, dtype=np.uint8, mode=mode, offset=HEADER_SIZE + header["layer_size"],
+                          shape=(cell_amount,))
+
+    return GridWorld(header["size_x"], header["size_y"], header["cell_size"], buffer=cells, floor_buffer=floor)